@@ -0,0 +1,463 @@
+import os
+import time
+import numpy as np
+from .schemes import Oned
+from .schemes.Oned import X, Y, Z, LA
+
+default_parameters = {
+    'D1Q2': {'la': 1., 'c': .5, 's': 1.8},
+    'D1Q3o': {'la': 1., 'ca': .5, 'cb': .5, 'sa': 1.8, 'sb': 1.2},
+    'D1Q3d': {'la': 1., 'c': .5, 's': 1.8},
+}
+
+def timeit(f, repeat = 5):
+    """
+    return the best elapsed time (in seconds) of repeat calls of f
+    """
+    best = np.inf
+    for k in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def eigenvalues_loop(sch):
+    """
+    reference implementation: one call of np.linalg.eig per wavenumber
+    """
+    G = np.zeros((sch.nv, sch.nv), dtype = 'complex128')
+    vvp = np.zeros((sch.nv*sch.vxi.size,), dtype = 'complex128')
+    for i in range(sch.vxi.size):
+        xi = sch.vxi[i]
+        for k in range(sch.nv):
+            G[k,:] = np.exp(-sch.v[k,0]*1j*xi) * sch.dG[k,:]
+        vvp[sch.nv*i:sch.nv*(i+1)] = np.linalg.eig(G)[0]
+    return vvp
+
+def spectrum_error(vvp, vvp_ref, nv):
+    """
+    maximal distance between two spectra computed for the same wavenumbers
+    (each eigenvalue is compared to the nearest one of the other spectrum)
+    """
+    a = vvp.reshape((-1, nv, 1))
+    b = vvp_ref.reshape((-1, 1, nv))
+    dist = np.abs(a - b)
+    return max(np.max(np.min(dist, axis = 2)), np.max(np.min(dist, axis = 1)))
+
+def eigenvalues(Nx_list = (200, 2000, 20000), repeat = 3):
+    """
+    compare the batched eigenvalue engine with the loop over the wavenumbers
+
+    Parameters
+    ----------
+
+    Nx_list : the numbers of wavenumbers, optional
+    repeat : integer, number of repetitions of each measure, optional
+
+    """
+    print("{0:>8s} {1:>8s} {2:>12s} {3:>12s} {4:>8s} {5:>10s}".format(
+        'scheme', 'Nx', 'loop (s)', 'batched (s)', 'speedup', 'error'))
+    for name, param in default_parameters.items():
+        for Nx in Nx_list:
+            sch = getattr(Oned, name)(Nx = Nx)
+            sch.fix_parameters(param)
+            tloop = timeit(lambda: eigenvalues_loop(sch), repeat)
+            tbatch = timeit(sch.eigenvalues, repeat)
+            err = spectrum_error(sch.vvp, eigenvalues_loop(sch), sch.nv)
+            print("{0:>8s} {1:8d} {2:12.3e} {3:12.3e} {4:8.1f} {5:10.1e}".format(
+                name, Nx, tloop, tbatch, tloop/tbatch, err))
+
+def moment_matrix_sympy(sch):
+    """
+    reference implementation: sympy substitution for each entry of M
+    """
+    M = np.zeros((sch.nv, sch.nv))
+    for i in range(sch.nv):
+        for j in range(sch.nv):
+            M[i, j] = sch.P[i].subs({LA: sch.la,
+                                     X: sch.v[j,min(0,sch.d-1)],
+                                     Y: sch.v[j,min(1,sch.d-1)],
+                                     Z: sch.v[j,min(2,sch.d-1)]
+                                     })
+    return M
+
+def parameters(repeat = 20):
+    """
+    compare the compiled moment matrix with the sympy substitutions
+
+    Parameters
+    ----------
+
+    repeat : integer, number of repetitions of each measure, optional
+
+    """
+    print("{0:>8s} {1:>12s} {2:>12s} {3:>8s} {4:>10s}".format(
+        'scheme', 'sympy (s)', 'compiled (s)', 'speedup', 'error'))
+    for name, param in default_parameters.items():
+        sch = getattr(Oned, name)()
+        sch.fix_parameters(param)
+        tsympy = timeit(lambda: moment_matrix_sympy(sch), repeat)
+        tcomp = timeit(lambda: sch.fix_parameters(param), repeat)
+        err = np.max(np.abs(sch.M - moment_matrix_sympy(sch)))
+        print("{0:>8s} {1:12.3e} {2:12.3e} {3:8.1f} {4:10.1e}".format(
+            name, tsympy, tcomp, tsympy/tcomp, err))
+
+def sweep(n = 40, processes_list = (1, 2, 4, 8)):
+    """
+    measure the scaling of scheme.sweep with the number of processes
+
+    Parameters
+    ----------
+
+    n : integer, number of values of each parameter, optional
+    processes_list : the numbers of processes, optional
+
+    """
+    sch = Oned.D1Q2()
+    sch.fix_parameters(default_parameters['D1Q2'])
+    ranges = {'s': np.linspace(0, 2, n),
+              'c': np.linspace(0, 1.5, n),
+              'la': np.linspace(.5, 1.5, n)}
+    print("{0:>10s} {1:>12s} {2:>8s}".format('processes', 'time (s)', 'speedup'))
+    tref = None
+    for processes in processes_list:
+        t = timeit(lambda: sch.sweep(ranges, processes = processes), 1)
+        tref = t if tref is None else tref
+        print("{0:10d} {1:12.3e} {2:8.1f}".format(processes, t, tref/t))
+
+def closed_form(N_list = (10**3, 10**4, 10**5), repeat = 3):
+    """
+    accuracy and throughput of the closed-form eigenvalues against np.linalg.eigvals
+    for random complex 2x2 and 3x3 matrices
+
+    Parameters
+    ----------
+
+    N_list : the numbers of matrices, optional
+    repeat : integer, number of repetitions of each measure, optional
+
+    """
+    rng = np.random.default_rng(42)
+    print("{0:>4s} {1:>8s} {2:>12s} {3:>12s} {4:>12s} {5:>10s}".format(
+        'nv', 'N', 'lapack (s)', 'closed (s)', 'Mmatrices/s', 'error'))
+    for nv in (2, 3):
+        for N in N_list:
+            G = rng.normal(size = (N, nv, nv)) + 1j*rng.normal(size = (N, nv, nv))
+            tlapack = timeit(lambda: np.linalg.eigvals(G), repeat)
+            tclosed = timeit(lambda: Oned.eigvals(G, method = 'closed'), repeat)
+            err = spectrum_error(Oned.eigvals(G, method = 'closed'), np.linalg.eigvals(G), nv)
+            print("{0:4d} {1:8d} {2:12.3e} {3:12.3e} {4:12.2f} {5:10.1e}".format(
+                nv, N, tlapack, tclosed, 1.e-6*N/tclosed, err))
+
+def adaptive(n = 100, Nx = 10**5, seed = 0):
+    """
+    compare the verdict of the adaptive sampling with a uniform sampling
+    of Nx wavenumbers for n random parameter sets of each scheme
+
+    Parameters
+    ----------
+
+    n : integer, number of parameter sets, optional
+    Nx : integer, number of wavenumbers of the uniform sampling, optional
+    seed : integer, seed of the random generator, optional
+
+    """
+    rng = np.random.default_rng(seed)
+    print("{0:>8s} {1:>10s} {2:>12s} {3:>12s} {4:>12s}".format(
+        'scheme', 'agreement', 'solves', 'uniform (s)', 'adaptive (s)'))
+    for name in default_parameters:
+        sch = getattr(Oned, name)(Nx = Nx)
+        agree, nsolve, tuniform, tadaptive = 0, 0, 0., 0.
+        for k in range(n):
+            param = {d['variable']: rng.uniform(d['min'], d['max']) for d in sch.p_model}
+            param['la'] = max(param['la'], .5)
+            sch.fix_parameters(param)
+            t0 = time.perf_counter()
+            stable = sch.spectral_radius() <= 1 + 1.e-8
+            t1 = time.perf_counter()
+            res = sch.adaptive_spectral_radius()
+            t2 = time.perf_counter()
+            agree += stable == res[1]
+            nsolve += res[4]
+            tuniform += t1 - t0
+            tadaptive += t2 - t1
+        print("{0:>8s} {1:9.0f}% {2:11.2f}% {3:12.3e} {4:12.3e}".format(
+            name, 100.*agree/n, 100.*nsolve/(n*Nx), tuniform/n, tadaptive/n))
+
+def boundary(n = 50, xtol = 1.e-4):
+    """
+    compare the continuation of the stability boundary with a grid sweep
+    in the plane (c, s) of the D1Q2 scheme
+
+    the grid of n x n points gives the boundary at the precision 1/n,
+    the continuation at the precision xtol
+
+    Parameters
+    ----------
+
+    n : integer, number of values of each parameter of the grid, optional
+    xtol : float, tolerance of the bisections of the continuation, optional
+
+    """
+    sch = Oned.D1Q2()
+    sch.fix_parameters(default_parameters['D1Q2'])
+    ranges = {'c': (0., 1.5), 's': (0., 2.5)}
+    t0 = time.perf_counter()
+    points, nsolve = sch.boundary(ranges, xtol = xtol)
+    t1 = time.perf_counter()
+    sch.sweep({k: np.linspace(*v, n) for k, v in ranges.items()}, processes = 1)
+    t2 = time.perf_counter()
+    print("{0:>14s} {1:>10s} {2:>12s} {3:>10s}".format('method', 'solves', 'time (s)', 'precision'))
+    print("{0:>14s} {1:10d} {2:12.3e} {3:10.1e}".format('continuation', nsolve, t1 - t0, xtol))
+    print("{0:>14s} {1:10d} {2:12.3e} {3:10.1e}".format('grid', n*n, t2 - t1, 1./n))
+    print("{0:>14s} {1:10.0f} {2:12.3e} {3:10.1e}".format('grid (same)', 1./xtol**2,
+                                                         (t2 - t1)/(n*xtol)**2, xtol))
+
+def warm_start(step = 0.01, repeat = 3, seed = 0):
+    """
+    compare the warm-started eigenvalues (refinement of the eigenvectors of
+    the previous parameters) with the full solves after a move of one step
+    of the first relaxation parameter, for the schemes without closed-form eigenvalues
+
+    Parameters
+    ----------
+
+    step : float, move of the parameter, optional
+    repeat : integer, number of repetitions of each measure, optional
+    seed : integer, seed of the random generator of the parameters, optional
+
+    """
+    rng = np.random.default_rng(seed)
+    print("{0:>8s} {1:>8s} {2:>12s} {3:>12s} {4:>9s} {5:>10s}".format(
+        'scheme', 'Nxi', 'lapack (s)', 'warm (s)', 'fallback', 'error'))
+    for name in ('D2Q5', 'D2Q9'):
+        sch = getattr(Oned, name)()
+        param = {d['variable']: rng.uniform(d['min'], d['max']) for d in sch.p_model}
+        param['la'] = 1.
+        sch.fix_parameters(param)
+        sch.eigenvalues(warm = True)
+        V = sch.V.copy()
+        s = [k for k in param if k.startswith('s')][0]
+        param[s] += step
+        sch.fix_parameters(param)
+        def warm():
+            sch.V[:] = V
+            sch.eigenvalues(warm = True)
+        twarm = timeit(warm, repeat)
+        vvp, fallback = sch.vvp.copy(), sch.fallback
+        tlapack = timeit(sch.eigenvalues, repeat)
+        err = spectrum_error(vvp, sch.vvp, sch.nv)
+        print("{0:>8s} {1:8d} {2:12.3e} {3:12.3e} {4:8.1f}% {5:10.1e}".format(
+            name, sch.Nxi, tlapack, twarm, 100.*fallback/sch.Nxi, err))
+
+def matplotlib_redraw(frames = 50):
+    """
+    compare the time per frame of the spectrum plot of D1Q2 with a full redraw
+    of the canvas and with the blitting mode of the matplotlib viewer
+
+    Parameters
+    ----------
+
+    frames : integer, number of frames, optional
+
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from .viewers import matplotlib_viewer
+    sch = Oned.D1Q2()
+    param = dict(default_parameters['D1Q2'])
+    values = np.linspace(1., 1.9, frames)
+    print("{0:>10s} {1:>14s}".format('mode', 'frame (ms)'))
+    for blit in (False, True):
+        fig = matplotlib_viewer.Fig(x_range = (-1.1, 1.1), y_range = (-1.1, 1.1),
+                                    x_label = 'real part', y_label = 'imaginary part',
+                                    width = 400, height = 400, blit = blit)
+        t = np.linspace(0, 2*np.pi, 1000)
+        fig.line(np.cos(t), np.sin(t), line_color = 'navy')
+        points = fig.scatter(np.zeros(2*sch.Nxi), np.zeros(2*sch.Nxi), color = 'orange', marker = 'circle')
+        x = np.linspace(-1, 1, 200)
+        area = fig.fill(x, np.zeros(x.size))
+        fig.fig.canvas.draw()
+        # the spectra are computed first: only the drawing is measured
+        spectra = []
+        for s in values:
+            param['s'] = s
+            sch.fix_parameters(param)
+            spectra.append(sch.eigenvalues().copy())
+        t0 = time.perf_counter()
+        for vvp, s in zip(spectra, values):
+            points.update(np.real(vvp), np.imag(vvp))
+            area.update(x, .1*s*(1 - x**2))
+            if blit:
+                fig.update()
+            else:
+                fig.fig.canvas.draw()
+        print("{0:>10s} {1:14.2f}".format('blit' if blit else 'full', 1.e3*(time.perf_counter() - t0)/frames))
+
+def export(n = 100, processes_list = (1, 2, 4, 8), directory = 'frames'):
+    """
+    measure the throughput of the headless export of the spectra of D1Q2
+    with the number of processes
+
+    Parameters
+    ----------
+
+    n : integer, number of frames, optional
+    processes_list : the numbers of processes, optional
+    directory : string, directory of the PNG files, optional
+
+    """
+    from . import stability
+    sch = Oned.D1Q2()
+    sch.fix_parameters(default_parameters['D1Q2'])
+    params = [{'s': s} for s in np.linspace(0, 2, n)]
+    filename = os.path.join(directory, 'spectrum_{0:05d}.png')
+    print("{0:>10s} {1:>12s} {2:>10s}".format('processes', 'time (s)', 'frames/s'))
+    for processes in processes_list:
+        t = timeit(lambda: stability.export_spectra(sch, params, filename, processes = processes), 1)
+        print("{0:10d} {1:12.3e} {2:10.1f}".format(processes, t, n/t))
+
+def advection_notebook(m0, c, s, la, nsteps):
+    """
+    reference implementation of the notebook advection_1D (ghost cells at both ends)
+    """
+    def equilibrium(m0, c):
+        return c*m0
+    def f2m(f0, f1, m0, m1, la):
+        m0[:] = f0 + f1
+        m1[:] = la*(f1 - f0)
+    def m2f(f0, f1, m0, m1, la):
+        f0[:] = 0.5*(m0-m1/la)
+        f1[:] = 0.5*(m0+m1/la)
+    def relaxation(m0, m1, c, s):
+        m1[:] = (1-s)*m1 + s*equilibrium(m0, c)
+    def transport(f0, f1):
+        f0[-1] = f0[1]
+        f1[0] = f1[-2]
+        f0[1:-1] = f0[2:]
+        f1[1:-1] = f1[:-2]
+    m0 = np.concatenate(([0.], m0, [0.]))
+    m1 = equilibrium(m0, c)
+    f0, f1 = np.empty(m0.shape), np.empty(m0.shape)
+    for k in range(nsteps):
+        relaxation(m0, m1, c, s)
+        m2f(f0, f1, m0, m1, la)
+        transport(f0, f1)
+        f2m(f0, f1, m0, m1, la)
+    return m0[1:-1], m1[1:-1]
+
+def waves_notebook(m0, m1, c, s, la, nsteps):
+    """
+    reference implementation of the notebook waves_1D (ghost cells at both ends)
+    """
+    def equilibrium(m0, c):
+        return .5*c**2*m0
+    def f2m(f0, f1, f2, m0, m1, m2, la):
+        m0[:] = f0 + f1 + f2
+        m1[:] = la * (f2 - f1)
+        m2[:] = .5* la**2 * (f1 + f2)
+    def m2f(f0, f1, f2, m0, m1, m2, la):
+        f0[:] = m0 - 2./la**2 * m2
+        f1[:] = -.5/la * m1 + 1/la**2 * m2
+        f2[:] = .5/la * m1 + 1/la**2 * m2
+    def relaxation(m0, m1, m2, c, s):
+        m2[:] *= (1-s)
+        m2[:] += s*equilibrium(m0, c)
+    def transport(f0, f1, f2):
+        f1[-1] = f1[1]
+        f2[0] = f2[-2]
+        f1[1:-1] = f1[2:]
+        f2[1:-1] = f2[:-2]
+    m0 = np.concatenate(([0.], m0, [0.]))
+    m1 = np.concatenate(([0.], m1, [0.]))
+    m2 = equilibrium(m0, c)
+    f0, f1, f2 = np.empty(m0.shape), np.empty(m0.shape), np.empty(m0.shape)
+    for k in range(nsteps):
+        relaxation(m0, m1, m2, c, s)
+        m2f(f0, f1, f2, m0, m1, m2, la)
+        transport(f0, f1, f2)
+        f2m(f0, f1, f2, m0, m1, m2, la)
+    return m0[1:-1], m1[1:-1]
+
+def kernels(N_list = (10**3, 10**4, 10**5, 10**6, 10**7), points = 10**7, repeat = 1, backend = 'numpy'):
+    """
+    compare the in-place kernels of lib.kernels with the functions of the
+    notebooks advection_1D (D1Q2) and waves_1D (D1Q3)
+
+    Parameters
+    ----------
+
+    N_list : the numbers of points in space, optional
+    points : integer, optional
+        number of updates of a point (the number of time steps is points/N)
+    repeat : integer, number of repetitions of each measure, optional
+    backend : string, backend of the kernels ('numpy' or 'numba'), optional
+
+    """
+    from . import kernels
+    # compilation of the numba backend
+    kernels.D1Q2(np.zeros(2), .5, 1.8, 1., backend = backend).run(1)
+    kernels.D1Q3(np.zeros(2), np.zeros(2), 2., 1.5, 3., backend = backend).run(1)
+    print("{0:>6s} {1:>9s} {2:>7s} {3:>13s} {4:>13s} {5:>8s} {6:>10s}".format(
+        'scheme', 'N', 'steps', 'notebook (s)', 'kernel (s)', 'speedup', 'error'))
+    for N in N_list:
+        nsteps = max(1, points//N)
+        x = (np.arange(N) + .5)/N
+        m0 = 1.*((x > .25) & (x < .5))
+        tnb = timeit(lambda: advection_notebook(m0, .5, 1.8, 1., nsteps), repeat)
+        ref = advection_notebook(m0, .5, 1.8, 1., nsteps)
+        sch = kernels.D1Q2(m0, .5, 1.8, 1., backend = backend)
+        tk = timeit(lambda: sch.run(nsteps), repeat)
+        sch = kernels.D1Q2(m0, .5, 1.8, 1., backend = backend)
+        sch.run(nsteps)
+        err = max(np.max(np.abs(a - b)) for a, b in zip(sch.moments(), ref))
+        print("{0:>6s} {1:9d} {2:7d} {3:13.3e} {4:13.3e} {5:8.1f} {6:10.1e}".format(
+            'D1Q2', N, nsteps, tnb, tk, tnb/tk, err))
+        x = 2*np.pi*x
+        m0, m1 = np.sin(2*x), np.zeros(N)
+        tnb = timeit(lambda: waves_notebook(m0, m1, 2., 1.5, 3., nsteps), repeat)
+        ref = waves_notebook(m0, m1, 2., 1.5, 3., nsteps)
+        sch = kernels.D1Q3(m0, m1, 2., 1.5, 3., backend = backend)
+        tk = timeit(lambda: sch.run(nsteps), repeat)
+        sch = kernels.D1Q3(m0, m1, 2., 1.5, 3., backend = backend)
+        sch.run(nsteps)
+        err = max(np.max(np.abs(a - b)) for a, b in zip(sch.moments()[:2], ref))
+        print("{0:>6s} {1:9d} {2:7d} {3:13.3e} {4:13.3e} {5:8.1f} {6:10.1e}".format(
+            'D1Q3', N, nsteps, tnb, tk, tnb/tk, err))
+
+def ensemble(n_members = 1000, N = 1000, nsteps = 1000, backend = 'numpy', workers = None, seed = 0):
+    """
+    compare an ensemble of D1Q2 simulations advanced together with the loop
+    over the parameter sets and with a single simulation of the same size
+
+    Parameters
+    ----------
+
+    n_members : integer, number of parameter sets (c, s, la), optional
+    N : integer, number of points in space, optional
+    nsteps : integer, number of time steps, optional
+    backend : string, backend of the kernels ('numpy' or 'numba'), optional
+    workers : integer, number of threads of the ensemble, optional
+    seed : integer, seed of the random generator, optional
+
+    """
+    from . import kernels
+    rng = np.random.default_rng(seed)
+    c = rng.uniform(-1, 1, n_members)
+    s = rng.uniform(0, 2, n_members)
+    la = rng.uniform(1, 2, n_members)
+    x = (np.arange(N) + .5)/N
+    m0 = 1.*((x > .25) & (x < .5))
+    kernels.D1Q2(m0, c[:2], s[:2], la[:2], backend = backend).run(1, workers = 2)
+    def loop():
+        for k in range(n_members):
+            kernels.D1Q2(m0, c[k], s[k], la[k], backend = backend).run(nsteps)
+    tloop = timeit(loop, 1)
+    ens = kernels.D1Q2(m0, c, s, la, backend = backend)
+    tens = timeit(lambda: ens.run(nsteps, workers = 1), 1)
+    ens = kernels.D1Q2(m0, c, s, la, backend = backend)
+    tthreads = timeit(lambda: ens.run(nsteps, workers = workers), 1)
+    single = kernels.D1Q2(np.tile(m0, n_members), .5, 1.8, 1., backend = backend)
+    tsingle = timeit(lambda: single.run(nsteps), 1)
+    print("{0:>12s} {1:>12s} {2:>12s} {3:>12s}".format('loop (s)', 'ensemble (s)', 'threads (s)', 'single (s)'))
+    print("{0:12.3e} {1:12.3e} {2:12.3e} {3:12.3e}".format(tloop, tens, tthreads, tsingle))
@@ -0,0 +1,323 @@
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import multiprocessing
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def _jit(f):
+    # compiled on the first call, the machine code is cached on disk;
+    # the GIL is released to advance the members in threads
+    return f if numba is None else numba.njit(cache = True, nogil = True)(f)
+
+@_jit
+def _d1q2_run(f0, f1, g0, g1, c, s, la, nsteps):
+    # nsteps of the D1Q2 scheme in one pass by step: relaxation on the
+    # distributions and periodic transport in g for each point.
+    # The arrays have the shape (M, N) and the parameters (M,),
+    # the result is in g if nsteps is odd
+    M, N = f0.shape
+    for m in range(M):
+        a0, a1, b0, b1 = f0[m], f1[m], g0[m], g1[m]
+        k, r = c[m]/la[m], .5*s[m]
+        for n in range(nsteps):
+            for i in range(N):
+                u, v = a0[i], a1[i]
+                w = r*(v - u - k*(u + v))
+                b0[i-1] = u + w
+                b1[i+1 if i < N-1 else 0] = v - w
+            a0, a1, b0, b1 = b0, b1, a0, a1
+    return nsteps % 2
+
+@_jit
+def _d1q3_run(f0, f1, f2, g1, g2, c, s, la, nsteps):
+    # same as _d1q2_run for the D1Q3 scheme (f0 is updated in place)
+    M, N = f0.shape
+    for m in range(M):
+        a0, a1, a2, b1, b2 = f0[m], f1[m], f2[m], g1[m], g2[m]
+        k, r = (c[m]/la[m])**2, .5*s[m]
+        for n in range(nsteps):
+            for i in range(N):
+                u, v, z = a0[i], a1[i], a2[i]
+                t = v + z
+                w = r*((u + t)*k - t)
+                a0[i] = u - 2*w
+                b1[i-1] = v + w
+                b2[i+1 if i < N-1 else 0] = z + w
+            a1, a2, b1, b2 = b1, b2, a1, a2
+    return nsteps % 2
+
+class kernel():
+    """
+    base class of the in-place kernels
+
+    the distributions have the shape (N,), or (n_members, N) for an ensemble
+    of independent simulations advanced together; the parameters are floats
+    or arrays of shape (n_members,)
+    """
+    def _setup(self, shape, c, s, la, block, backend):
+        # the parameters are stored with the shape (n_members, 1),
+        # return the shape of the distributions
+        c, s, la = [np.asarray(p, dtype = 'float64')[..., np.newaxis] for p in (c, s, la)]
+        shape = np.broadcast_shapes(shape, c.shape, s.shape, la.shape)
+        self.c, self.s, self.la = [np.array(np.broadcast_to(p, shape[:-1] + (1,))) for p in (c, s, la)]
+        self.N = shape[-1]
+        self.block = block
+        self.backend = 'numpy' if numba is None else backend
+        # buffers of the relaxation
+        self.w = np.empty(shape[:-1] + (min(block, self.N),))
+        self.t = np.empty(shape[:-1] + (min(block, self.N),))
+        return shape
+
+    @property
+    def n_members(self):
+        """
+        number of members of the ensemble (0 for a single simulation)
+        """
+        return self.f[0].shape[0] if self.f[0].ndim > 1 else 0
+
+    def _members(self, a, b):
+        # kernel of the members a to b: views of the distributions
+        # and of the parameters, own buffers
+        sub = copy.copy(self)
+        sub.f = [f[a:b] for f in self.f]
+        sub.g = [None if g is None else g[a:b] for g in self.g]
+        sub.c, sub.s, sub.la = self.c[a:b], self.s[a:b], self.la[a:b]
+        sub.w, sub.t = self.w[a:b], self.t[a:b]
+        return sub
+
+    def step(self):
+        """
+        one time step: relaxation and transport block by block,
+        then the buffers are swapped with the distributions
+        """
+        if self.backend == 'numba':
+            return self.run(1)
+        for a in range(0, self.N, self.block):
+            b = min(a + self.block, self.N)
+            self._collide(a, b)
+            self._transport(a, b)
+        self._swap()
+
+    def run(self, nsteps, workers = 1):
+        """
+        nsteps time steps
+
+        Parameters
+        ----------
+
+        nsteps : integer, number of time steps
+        workers : integer, optional
+            number of threads for an ensemble, each thread advances
+            a part of the members (None for the number of cores)
+
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        n = self.n_members
+        # with numpy, the members are advanced by groups of about block points
+        # (each group does all the time steps while it is in the cache)
+        groups = workers if self.backend == 'numba' else -(-n*self.N // self.block)
+        groups = max(1, min(max(groups, workers), n))
+        if groups == 1:
+            self._run(nsteps)
+            return
+        bounds = np.linspace(0, n, groups + 1).astype('int')
+        subs = [self._members(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            list(executor.map(lambda sub: sub._run(nsteps), subs))
+        if nsteps % 2:
+            self._swap()
+
+    def _run(self, nsteps):
+        if self.backend == 'numba':
+            if self._compiled(nsteps):
+                self._swap()
+            return
+        step = self.step
+        for k in range(nsteps):
+            step()
+
+class D1Q2(kernel):
+    """
+    in-place kernel of the D1Q2 scheme for the advection equation
+    with periodic boundary conditions
+
+    the velocities are -la (f0) and la (f1), the moments m0 = f0 + f1,
+    m1 = la (f1 - f0) and the equilibrium m1 = c m0. The distributions
+    are stored without ghost cells and the time step (relaxation,
+    back transformation and transport) is done in preallocated arrays,
+    block by block to stay in the cache.
+
+    Parameters
+    ----------
+
+    m0 : numpy array of the initial values (the distributions are at equilibrium)
+        of shape (N,) or (n_members, N)
+    c : float or array (n_members,), velocity of the advection
+    s : float or array (n_members,), relaxation parameter
+    la : float or array (n_members,), optional, scheme velocity
+    block : integer, optional
+        the time step is done by blocks of points that stay in the cache
+    backend : string, optional
+        'numpy' or 'numba': with numba, the time steps are compiled and done
+        in one pass over the distributions (numpy is used if numba is not installed)
+
+    """
+    def __init__(self, m0, c, s, la = 1., block = 2**14, backend = 'numpy'):
+        shape = self._setup(m0.shape, c, s, la, block, backend)
+        self.f = [np.empty(shape) for k in range(2)]
+        # buffers of the transport
+        self.g = [np.empty(shape) for k in range(2)]
+        self.set_moments(m0, self.c*m0)
+
+    def set_moments(self, m0, m1):
+        """
+        set the distributions from the moments
+        """
+        np.multiply(.5, m0 - m1/self.la, out = self.f[0])
+        np.multiply(.5, m0 + m1/self.la, out = self.f[1])
+
+    def moments(self, out = None):
+        """
+        return the moments (m0, m1), computed in out if given
+        """
+        f0, f1 = self.f
+        if out is None:
+            out = (np.empty(f0.shape), np.empty(f0.shape))
+        np.add(f0, f1, out = out[0])
+        np.subtract(f1, f0, out = out[1])
+        np.multiply(out[1], self.la, out = out[1])
+        return out
+
+    def _collide(self, a, b):
+        # relaxation of m1 towards c m0 written on the distributions:
+        # f0 += w and f1 -= w with w = s/2 (f1 - f0 - c/la (f0 + f1))
+        f0, f1 = self.f[0][..., a:b], self.f[1][..., a:b]
+        w, t = self.w[..., :b-a], self.t[..., :b-a]
+        np.subtract(f1, f0, out = w)
+        np.add(f0, f1, out = t)
+        t *= self.c/self.la
+        w -= t
+        w *= .5*self.s
+        f0 += w
+        f1 -= w
+
+    def _transport(self, a, b):
+        # periodic transport of the points a to b in the buffers:
+        # f0 moves to the left and f1 to the right
+        f0, f1 = self.f
+        g0, g1 = self.g
+        if a == 0:
+            g0[..., -1] = f0[..., 0]
+            g0[..., :b-1] = f0[..., 1:b]
+        else:
+            g0[..., a-1:b-1] = f0[..., a:b]
+        if b == self.N:
+            g1[..., 0] = f1[..., -1]
+            g1[..., a+1:] = f1[..., a:-1]
+        else:
+            g1[..., a+1:b+1] = f1[..., a:b]
+
+    def _swap(self):
+        self.f, self.g = self.g, self.f
+
+    def _compiled(self, nsteps):
+        f, g = [a.reshape(-1, self.N) for a in self.f], [a.reshape(-1, self.N) for a in self.g]
+        return _d1q2_run(*f, *g, self.c.ravel(), self.s.ravel(), self.la.ravel(), nsteps)
+
+class D1Q3(kernel):
+    """
+    in-place kernel of the D1Q3 scheme for the wave equation
+    with periodic boundary conditions
+
+    the velocities are 0 (f0), -la (f1) and la (f2), the moments
+    m0 = f0 + f1 + f2, m1 = la (f2 - f1), m2 = la^2 (f1 + f2) / 2 and the
+    equilibrium m2 = c^2 m0 / 2. The distributions are stored without ghost
+    cells and the time step is done in preallocated arrays.
+
+    Parameters
+    ----------
+
+    m0 : numpy array of the initial density of shape (N,) or (n_members, N)
+    m1 : numpy array of the initial momentum
+    c : float or array (n_members,), velocity of the waves
+    s : float or array (n_members,), relaxation parameter
+    la : float or array (n_members,), optional, scheme velocity
+    block : integer, optional
+        the time step is done by blocks of points that stay in the cache
+    backend : string, optional
+        'numpy' or 'numba': with numba, the time steps are compiled and done
+        in one pass over the distributions (numpy is used if numba is not installed)
+
+    """
+    def __init__(self, m0, m1, c, s, la = 1., block = 2**14, backend = 'numpy'):
+        shape = self._setup(np.broadcast_shapes(m0.shape, m1.shape), c, s, la, block, backend)
+        self.f = [np.empty(shape) for k in range(3)]
+        # f0 does not move: no buffer
+        self.g = [None] + [np.empty(shape) for k in range(2)]
+        self.set_moments(m0, m1, .5*self.c**2*m0)
+
+    def set_moments(self, m0, m1, m2):
+        """
+        set the distributions from the moments
+        """
+        la = self.la
+        np.subtract(m0, 2./la**2*m2, out = self.f[0])
+        np.add(-.5/la*m1, m2/la**2, out = self.f[1])
+        np.add(.5/la*m1, m2/la**2, out = self.f[2])
+
+    def moments(self, out = None):
+        """
+        return the moments (m0, m1, m2), computed in out if given
+        """
+        f0, f1, f2 = self.f
+        if out is None:
+            out = (np.empty(f0.shape), np.empty(f0.shape), np.empty(f0.shape))
+        np.add(f1, f2, out = out[2])
+        np.add(f0, out[2], out = out[0])
+        np.multiply(out[2], .5*self.la**2, out = out[2])
+        np.subtract(f2, f1, out = out[1])
+        np.multiply(out[1], self.la, out = out[1])
+        return out
+
+    def _collide(self, a, b):
+        # relaxation of m2 towards c^2 m0 / 2 written on the distributions:
+        # f0 -= 2 w, f1 += w and f2 += w with w = s/2 ((c/la)^2 m0 - f1 - f2)
+        f0, f1, f2 = [f[..., a:b] for f in self.f]
+        w, t = self.w[..., :b-a], self.t[..., :b-a]
+        np.add(f1, f2, out = t)
+        np.add(f0, t, out = w)
+        w *= (self.c/self.la)**2
+        w -= t
+        w *= .5*self.s
+        f1 += w
+        f2 += w
+        w *= 2
+        f0 -= w
+
+    def _transport(self, a, b):
+        # periodic transport of the points a to b in the buffers:
+        # f1 moves to the left and f2 to the right
+        f1, f2 = self.f[1:]
+        g1, g2 = self.g[1:]
+        if a == 0:
+            g1[..., -1] = f1[..., 0]
+            g1[..., :b-1] = f1[..., 1:b]
+        else:
+            g1[..., a-1:b-1] = f1[..., a:b]
+        if b == self.N:
+            g2[..., 0] = f2[..., -1]
+            g2[..., a+1:] = f2[..., a:-1]
+        else:
+            g2[..., a+1:b+1] = f2[..., a:b]
+
+    def _swap(self):
+        f0, f1, f2 = self.f
+        self.f, self.g = [f0, self.g[1], self.g[2]], [None, f1, f2]
+
+    def _compiled(self, nsteps):
+        f, g = [a.reshape(-1, self.N) for a in self.f], [a.reshape(-1, self.N) for a in self.g[1:]]
+        return _d1q3_run(*f, *g, self.c.ravel(), self.s.ravel(), self.la.ravel(), nsteps)
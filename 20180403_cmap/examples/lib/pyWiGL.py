@@ -1,5 +1,143 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
 import ipywidgets as widgets
-from IPython.display import display
+from IPython.display import display, clear_output
+
+class _thread_stdout():
+    """
+    replacement of sys.stdout that keeps the text written by one thread,
+    the other threads write in the original stream
+    """
+    def __init__(self, stream, thread):
+        self.stream = stream
+        self.thread = thread
+        self.text = []
+
+    def write(self, s):
+        if threading.current_thread() is self.thread:
+            self.text.append(s)
+            return len(s)
+        return self.stream.write(s)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class dispatcher():
+    """
+    debounced and coalescing dispatch of the updates of an interactive graph
+
+    the callback is called with the latest values only once no event
+    has been received during delay seconds: the intermediate values are dropped
+
+    Parameters
+    ----------
+
+    f : the callback, called with the values of the widgets as keyword arguments
+    out : ipywidgets.Output that captures the output of the callback
+    delay : float, optional
+        debounce window in seconds (0 for a synchronous call)
+    background : boolean, optional
+        if True, the callback runs in a worker thread so that the kernel stays responsive
+        (the text printed by the callback is captured and written in out)
+
+    """
+    def __init__(self, f, out, delay = 0.05, background = False):
+        self.f = f
+        self.out = out
+        self.delay = delay
+        self.background = background
+        self.cond = threading.Condition()
+        self.pending = None
+        self.last_event = 0.
+        self.handle = None
+        self.calls = 0
+        self.dropped = 0
+        self.running = True
+        if self.background:
+            self.thread = threading.Thread(target = self._worker, daemon = True)
+            self.thread.start()
+        else:
+            try:
+                self.loop = asyncio.get_event_loop()
+            except RuntimeError:
+                self.loop = None
+
+    def __call__(self, **args):
+        with self.cond:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = args
+            self.last_event = time.monotonic()
+            self.cond.notify()
+        if self.background:
+            return
+        if self.delay > 0 and self.loop is not None and self.loop.is_running():
+            if self.handle is not None:
+                self.handle.cancel()
+            self.handle = self.loop.call_later(self.delay, self._run)
+        else:
+            self._run()
+
+    def _run(self):
+        with self.cond:
+            args, self.pending = self.pending, None
+        if args is None:
+            return
+        self.calls += 1
+        if self.background:
+            self._run_captured(args)
+            return
+        with self.out:
+            clear_output(wait = True)
+            self.f(**args)
+
+    def _run_captured(self, args):
+        # the output context of the widget cannot be used from the worker thread:
+        # the text printed by the callback is captured and the widget is modified
+        # through its outputs
+        stdout = _thread_stdout(sys.stdout, threading.current_thread())
+        sys.stdout = stdout
+        error = None
+        try:
+            self.f(**args)
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            if sys.stdout is stdout:
+                sys.stdout = stdout.stream
+        self.out.outputs = ()
+        if stdout.text:
+            self.out.append_stdout(''.join(stdout.text))
+        if error is not None:
+            self.out.append_stderr(error)
+
+    def _worker(self):
+        while self.running:
+            with self.cond:
+                while self.pending is None and self.running:
+                    self.cond.wait()
+                # wait for the end of the burst of events
+                while self.running:
+                    remaining = self.last_event + self.delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+            if self.running:
+                self._run()
+
+    def close(self):
+        """
+        stop the worker thread and drop the pending update
+        """
+        with self.cond:
+            self.running = False
+            self.pending = None
+            self.cond.notify()
+        if self.handle is not None:
+            self.handle.cancel()
 
 class interactive_graph():
     def __init__(self):
@@ -126,7 +264,20 @@ class interactive_graph():
     #     self.wid.append(wid)
     #     self.variables[dico['variable']] = self.wid[n]
 
-    def build(self, f):
+    def build(self, f, delay = 0.05, background = False):
+        """
+        build the widgets and connect them to the callback f
+
+        Parameters
+        ----------
+
+        f : the callback, called with the values of the widgets as keyword arguments
+        delay : float, optional
+            debounce window in seconds (0 for a synchronous call at each event)
+        background : boolean, optional
+            if True, the callback runs in a worker thread
+
+        """
         # self.ui = widgets.Box(self.wid, layout=widgets.Layout(
         #             display='flex',
         #             flex_flow='column',
@@ -136,7 +287,12 @@ class interactive_graph():
         #             #height='300px',
         # ))
         #self.out = widgets.interactive_output(f, self.variables)
-        self.wid.append(widgets.interactive_output(f, self.variables))
+        self.out = widgets.Output()
+        self.dispatch = dispatcher(f, self.out, delay = delay, background = background)
+        for w in self.variables.values():
+            w.observe(self._observer, 'value')
+        self._observer(None)
+        self.wid.append(self.out)
         self.interactive_plot = widgets.Box(self.wid,
                                             layout=widgets.Layout(display='flex',
                                                                    flex_flow='column',
@@ -147,5 +303,8 @@ class interactive_graph():
                                                                    )
                                              )
 
+    def _observer(self, change):
+        self.dispatch(**{k: w.value for k, w in self.variables.items()})
+
     def plot(self):
         display(self.interactive_plot)
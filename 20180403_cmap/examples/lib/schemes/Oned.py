@@ -1,45 +1,807 @@
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
 import numpy as np
 import sympy as sp
 
+from . import eqeq
+
 X, Y, Z, LA = sp.symbols('X, Y, Z, LA')
 
+# state of a worker process of scheme.sweep
+_sweep_state = {}
+
+def _sweep_chunk(sch, names, values, out, start, stop):
+    param = dict(sch.param)
+    for n in range(start, stop):
+        idx = np.unravel_index(n, out.shape)
+        for k, name in enumerate(names):
+            param[name] = values[k][idx[k]]
+        sch.fix_parameters(param)
+        out.flat[n] = sch.spectral_radius()
+
+def _sweep_init(sch, names, values, shm_name, shape):
+    shm = shared_memory.SharedMemory(name = shm_name)
+    _sweep_state['shm'] = shm
+    _sweep_state['args'] = (sch, names, values, np.ndarray(shape, dtype = 'float64', buffer = shm.buf))
+
+def _sweep_task(bounds):
+    _sweep_chunk(*_sweep_state['args'], *bounds)
+
+def characteristic_polynomial(G):
+    """
+    coefficients of the characteristic polynomials of a stack of 2x2 or 3x3 matrices
+
+    return the list [c_1, ..., c_nv] of arrays such that
+    det(lambda I - G) = lambda^nv + c_1 lambda^(nv-1) + ... + c_nv
+    """
+    nv = G.shape[-1]
+    tr = np.einsum('...ii->...', G)
+    if nv == 2:
+        det = G[..., 0, 0]*G[..., 1, 1] - G[..., 0, 1]*G[..., 1, 0]
+        return [-tr, det]
+    minors = G[..., 1, 1]*G[..., 2, 2] - G[..., 1, 2]*G[..., 2, 1]
+    c2 = minors + G[..., 0, 0]*G[..., 2, 2] - G[..., 0, 2]*G[..., 2, 0] \
+                + G[..., 0, 0]*G[..., 1, 1] - G[..., 0, 1]*G[..., 1, 0]
+    det = G[..., 0, 0]*minors \
+        - G[..., 0, 1]*(G[..., 1, 0]*G[..., 2, 2] - G[..., 1, 2]*G[..., 2, 0]) \
+        + G[..., 0, 2]*(G[..., 1, 0]*G[..., 2, 1] - G[..., 1, 1]*G[..., 2, 0])
+    return [-tr, c2, -det]
+
+def _roots_quadratic(b, c, rtol):
+    # roots of x^2 + b x + c, the sign of the square root avoids cancellation
+    disc = np.sqrt(b*b - 4*c)
+    disc = np.where(np.real(np.conj(b)*disc) < 0, -disc, disc)
+    q = -.5*(b + disc)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        r = np.stack([q, c/q], axis = -1)
+    ill = np.abs(disc)**2 <= rtol*(np.abs(b)**2 + np.abs(c))
+    return r, ill
+
+def _roots_cubic(a, b, c, rtol):
+    # roots of x^3 + a x^2 + b x + c by the Cardano formulas
+    p = b - a*a/3
+    q = (2*a*a - 9*b)*a/27 + c
+    delta = np.sqrt(.25*q*q + p*p*p/27)
+    delta = np.where(np.real(np.conj(q)*delta) < 0, -delta, delta)
+    u = (-.5*q - delta)**(1./3)
+    j = np.exp(2j*np.pi/3)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        v = np.where(u == 0, 0, -p/(3*u))
+        r = np.stack([u + v, j*u + v/j, u/j + j*v], axis = -1) - a[..., np.newaxis]/3
+        # one Newton iteration to polish the roots
+        pr = ((r + a[..., np.newaxis])*r + b[..., np.newaxis])*r + c[..., np.newaxis]
+        dpr = (3*r + 2*a[..., np.newaxis])*r + b[..., np.newaxis]
+        r = np.where(dpr != 0, r - pr/dpr, r)
+    ill = np.abs(delta)**2 <= rtol*(np.abs(.5*q)**2 + np.abs(p/3)**3)
+    return r, ill
+
+def eigvals(G, method = 'auto', rtol = 1.e-8):
+    """
+    eigenvalues of a stack of matrices of shape (N, nv, nv)
+
+    Parameters
+    ----------
+
+    G : array of shape (N, nv, nv)
+    method : string, optional
+        'lapack' for np.linalg.eigvals,
+        'closed' for the closed-form formulas (nv = 2 or 3),
+        'auto' for the closed-form formulas when they are available
+    rtol : float, optional
+        the matrices close to a multiple eigenvalue (relative discriminant
+        under rtol) or with an estimated error on the closed-form eigenvalues
+        over rtol (coefficients of the characteristic polynomial spoiled by
+        cancellations) are given to np.linalg.eigvals
+
+    Returns
+    -------
+
+    array of shape (N, nv)
+
+    """
+    nv = G.shape[-1]
+    if method == 'lapack' or (method == 'auto' and nv > 3) or nv == 1:
+        return np.linalg.eigvals(G)
+    if nv > 3:
+        raise ValueError("closed-form eigenvalues are only available for nv = 2 or 3")
+    coeffs = characteristic_polynomial(G)
+    if nv == 2:
+        r, ill = _roots_quadratic(*coeffs, rtol)
+    else:
+        r, ill = _roots_cubic(*coeffs, rtol)
+    ill |= ~np.all(np.isfinite(r), axis = -1)
+    # a posteriori check: the rounding errors on the coefficients c_k are of the
+    # order of eps (nv |G|)^k (large compared to c_k when the entries of G cancel),
+    # the error on a root r is this error on p(r) divided by |p'(r)|
+    with np.errstate(invalid = 'ignore', over = 'ignore'):
+        scale = nv*np.max(np.abs(G), axis = (-2, -1))[..., np.newaxis]
+        a = np.abs(r)
+        dp = np.prod([r - np.roll(r, k, axis = -1) for k in range(1, nv)], axis = 0)
+        err = np.finfo(G.dtype).eps*((scale + a)**nv - a**nv)
+        ill |= np.any(err > rtol*np.maximum(1, a)*np.abs(dp), axis = -1)
+    if np.any(ill):
+        r[ill] = np.linalg.eigvals(G[ill])
+    return r
+
+def refine_eig(G, V, maxiter = 3, tol = 1.e-10, sep = 1.e-1):
+    """
+    refine the eigenvectors V of matrices close to G (the matrices of the
+    previous parameters) to get the eigenvalues of G
+
+    at each iteration B = V^-1 G V = D + F with D diagonal, the eigenvalues are
+    d_j + sum_i F_ji F_ij / (d_j - d_i) and the eigenvectors V (I + E) with
+    E_ij = F_ij / (d_j - d_i): the off-diagonal part of B decreases quadratically
+    and the error on the eigenvalues is of the order of |E|^2 |F|
+
+    Parameters
+    ----------
+
+    G : array of shape (N, nv, nv)
+    V : array of shape (N, nv, nv), the starting eigenvectors
+    maxiter : integer, optional
+        maximal number of iterations
+    tol : float, optional
+        relative error under which the eigenvalues are converged
+    sep : float, optional
+        maximal size of the corrections of the eigenvectors
+        (larger near multiple eigenvalues, where the iterations do not converge)
+
+    Returns
+    -------
+
+    r : array of shape (N, nv), the eigenvalues
+    V : array of shape (N, nv, nv), the eigenvectors
+    ok : boolean array of shape (N,), False where the refinement failed
+
+    """
+    eye = np.eye(G.shape[-1], dtype = 'bool')
+    r = np.empty(G.shape[:-1], dtype = 'complex128')
+    V = V.copy()
+    ok = np.zeros(G.shape[0], dtype = 'bool')
+    # indices of the matrices not converged yet
+    todo = np.arange(G.shape[0])
+    with np.errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+        for it in range(maxiter):
+            Vt = V[todo]
+            B = np.linalg.solve(Vt, G[todo] @ Vt)
+            d = np.diagonal(B, axis1 = -2, axis2 = -1)
+            F = np.where(eye, 0, B)
+            E = F/(d[:, np.newaxis, :] - d[:, :, np.newaxis])
+            E[:, eye] = 0
+            r[todo] = d + np.einsum('nji,nij->nj', F, E)
+            V[todo] = Vt + Vt @ E
+            e = np.max(np.abs(E), axis = (1, 2))
+            ok[todo] = (e*e*np.max(np.abs(F), axis = (1, 2)) <= tol*(1 + np.max(np.abs(d), axis = 1))) & (e < sep)
+            todo = todo[~ok[todo]]
+            if todo.size == 0:
+                break
+        ok &= np.all(np.isfinite(r), axis = -1)
+    return r, V, ok
+
+def track_branches(vp):
+    """
+    reorder the eigenvalues vp of shape (Nx, nv) (one line per wavenumber)
+    so that each column follows a continuous branch
+
+    for each couple of consecutive wavenumbers, the permutation that minimizes
+    the distance between the eigenvalues is chosen among all the permutations
+    (vectorized over the wavenumbers, nv <= 4) or greedily (nv > 4)
+    """
+    Nx, nv = vp.shape
+    if nv <= 4:
+        perms = np.array(list(itertools.permutations(range(nv))))
+        # cost[i, p] = sum_k |vp[i+1, perms[p, k]] - vp[i, k]|
+        cost = np.abs(vp[1:, perms] - vp[:-1, np.newaxis, :]).sum(axis = -1)
+        best = perms[np.argmin(cost, axis = 1)]
+    else:
+        best = np.empty((Nx - 1, nv), dtype = 'int')
+        for i in range(Nx - 1):
+            free = list(range(nv))
+            for k in range(nv):
+                j = free[np.argmin(np.abs(vp[i+1, free] - vp[i, k]))]
+                best[i, k] = j
+                free.remove(j)
+    index = np.empty((Nx, nv), dtype = 'int')
+    index[0] = np.arange(nv)
+    for i in range(Nx - 1):
+        index[i+1] = best[i][index[i]]
+    return np.take_along_axis(vp, index, axis = 1)
+
+def smallest_singular_value(A):
+    """
+    smallest singular value of a stack of matrices A (..., nv, nv)
+
+    closed form for nv = 2: sigma_min = |det A| / sigma_max with
+    sigma_max^2 = (F + sqrt(F^2 - 4 |det A|^2)) / 2, F the squared Frobenius norm
+    """
+    if A.shape[-1] != 2:
+        return np.linalg.svd(A, compute_uv = False)[..., -1]
+    F = np.sum(np.abs(A)**2, axis = (-2, -1))
+    det = np.abs(A[..., 0, 0]*A[..., 1, 1] - A[..., 0, 1]*A[..., 1, 0])
+    smax = np.sqrt(.5*(F + np.sqrt(np.maximum(F*F - 4*det*det, 0))))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(smax > 0, det/smax, 0.)
+
 class scheme():
     _name = 'generic'
+    # attributes built by _compile_moments (they cannot be pickled)
+    _compiled = ('_P', '_eqeq')
+    # order of the equivalent equations
+    eqeq_order = 2
 
-    def __init__(self, Nx = 200):
+    def __init__(self, Nx = 200, method = 'auto', Ny = None, chunk_size = 2**22):
+        self.method = method
         self._define_scheme()
         self.nv = self.v.shape[0]
         self.d = self.v.shape[1]
+        if not hasattr(self, 'M_sym'):
+            self.M_sym = sp.Matrix(self.nv, self.nv,
+                                   lambda i, j: self.P[i].subs({X: self.v[j, 0],
+                                                                Y: self.v[j, min(1, self.d-1)],
+                                                                Z: self.v[j, min(2, self.d-1)]}))
+        self._compile_moments()
         self.M = np.zeros((self.nv, self.nv))
         self.iM = np.zeros((self.nv, self.nv))
         self.R = np.zeros((self.nv, self.nv))
-        self.G = np.zeros((self.nv, self.nv), dtype = 'complex128')
         self.dG = np.zeros((self.nv, self.nv))
 
         self.vxi = np.linspace(0, 2*np.pi, Nx)
-        self.vvp = np.zeros((self.nv*self.vxi.size,), dtype = 'complex128')
+        if self.d == 1:
+            self.shape = (Nx,)
+            self.xi = self.vxi[:, np.newaxis]
+        else:
+            self.vyi = np.linspace(0, 2*np.pi, Nx if Ny is None else Ny)
+            self.shape = (self.vxi.size, self.vyi.size)
+            xi, yi = np.meshgrid(self.vxi, self.vyi, indexing = 'ij')
+            self.xi = np.stack([xi.ravel(), yi.ravel()], axis = -1)
+        self.Nxi = self.xi.shape[0]
+        self.vvp = np.zeros((self.nv*self.Nxi,), dtype = 'complex128')
+        # eigenvectors of the previous parameters (starting values of
+        # eigenvalues(warm = True)), allocated by the first warm solve
+        self.V = None
+        self.warm_ready = False
+        self.fallback = 0
+        # phase shifts exp(-i v_k.xi) do not depend on the parameters:
+        # compute them once, G(xi) = diag(phase(xi)) dG is then built in place
+        self.phase = np.exp(-1j*np.dot(self.xi, self.v[:, :2].T))
+        # the amplification matrices are built by chunks of wavenumbers
+        # (chunk_size complex entries at most)
+        self.chunk_size = chunk_size
+        self.chunk = max(1, min(self.Nxi, chunk_size // self.nv**2))
+        self.G = np.zeros((self.chunk, self.nv, self.nv), dtype = 'complex128')
+
+    def __getstate__(self):
+        # the lambdified functions cannot be pickled: compile them again
+        state = self.__dict__.copy()
+        for k in self._compiled:
+            state.pop(k, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile_moments()
 
     def _define_scheme(self):
         pass
 
+    def _compile_moments(self):
+        """
+        compile the polynomials P once into a numeric function of LA, X, Y, Z
+
+        the symbolic work is done here so that a change of the parameters
+        only requires NumPy operations
+        """
+        self._P = sp.lambdify((LA, X, Y, Z), list(self.P), 'numpy')
+        self._vx = self.v[:, 0]
+        self._vy = self.v[:, min(1, self.d-1)]
+        self._vz = self.v[:, min(2, self.d-1)]
+
+    def _eqeq_symbols(self):
+        """
+        return the names of the parameters and the corresponding sympy symbols
+        """
+        names = list(self.param)
+        return names, [LA if name == 'la' else sp.Symbol(name) for name in names]
+
+    def compute_eqeq(self):
+        """
+        compute the string self.eqeq of the equivalent equations up to the order eqeq_order
+
+        the equivalent equations are derived from v, M_sym and R_sym (see schemes.eqeq)
+        at the first call (the result is cached on disk), then only the
+        compiled coefficients are evaluated
+        """
+        if getattr(self, '_eqeq', None) is None:
+            names, symbols = self._eqeq_symbols()
+            terms = eqeq.derive_cached(self.v, self.M_sym, self.R_sym,
+                                       self.conserved, self.eqeq_order)
+            self._eqeq = eqeq.equivalent_equations(terms, symbols, self.moments,
+                                                  self.eqeq_order, self.d)
+            self._eqeq_names = names
+        self.eqeq = self._eqeq.format([self.param[name] for name in self._eqeq_names])
+
     def fix_parameters_generic(self):
-        for i in range(self.nv):
-            for j in range(self.nv):
-                self.M[i, j] = self.P[i].subs({LA: self.la,
-                                          X: self.v[j,min(0,self.d-1)],
-                                          Y: self.v[i,min(1,self.d-1)],
-                                          Z: self.v[i,min(2,self.d-1)]
-                                          })
+        for i, p in enumerate(self._P(self.la, self._vx, self._vy, self._vz)):
+            self.M[i, :] = p
         self.iM[:] = np.linalg.inv(self.M)
         self.dG[:] = np.dot(self.iM, np.dot(self.R, self.M))
 
-    def eigenvalues(self):
-        for i in range(self.vxi.size):
-            xi = self.vxi[i]
-            for k in range(self.nv):
-                self.G[k,:] = np.exp(-self.v[k,0]*1j*xi) * self.dG[k,:]
-            self.vvp[self.nv*i:self.nv*(i+1)] = np.linalg.eig(self.G)[0]
+    def amplification_matrices(self, start = 0, stop = None):
+        """
+        build the amplification matrices G(xi) for the wavenumbers start to stop
+        (one chunk by default)
+
+        G[i] = diag(exp(-i v.xi_i)) dG, stored in the (chunk, nv, nv) buffer self.G
+        """
+        if stop is None:
+            stop = min(self.Nxi, start + self.chunk)
+        G = self.G[:stop-start]
+        np.multiply(self.phase[start:stop, :, np.newaxis], self.dG[np.newaxis, :, :], out = G)
+        return G
+
+    def eigenvalues(self, warm = False, cancel = None):
+        """
+        compute the eigenvalues of all the amplification matrices
+
+        each (chunk, nv, nv) stack is solved at once (see eigvals for the methods)
+        and the spectrum is written in place in self.vvp
+
+        if warm is True and nv > 3 (no closed-form eigenvalues), the eigenvectors
+        of the previous warm solve are refined (see refine_eig) instead of solving
+        again; the wavenumbers where the refinement fails are solved again
+        (their number is stored in self.fallback). For nv = 2 or 3 the full
+        solves are as fast as the refinement: the warm start is not used.
+
+        cancel is an optional function called before each chunk: if it returns
+        True the computation stops and None is returned (self.vvp is incomplete)
+        """
+        vvp = self.vvp.reshape((self.Nxi, self.nv))
+        warm = warm and self.nv > 3
+        if warm and self.V is None:
+            self.V = np.empty((self.Nxi, self.nv, self.nv), dtype = 'complex128')
+        self.fallback = 0
+        for start in range(0, self.Nxi, self.chunk):
+            if cancel is not None and cancel():
+                return None
+            G = self.amplification_matrices(start)
+            stop = start + G.shape[0]
+            if not warm:
+                vvp[start:stop] = eigvals(G, method = self.method)
+            elif self.warm_ready:
+                r, V, ok = refine_eig(G, self.V[start:stop])
+                if not np.all(ok):
+                    r[~ok], V[~ok] = np.linalg.eig(G[~ok])
+                    self.fallback += np.count_nonzero(~ok)
+                vvp[start:stop], self.V[start:stop] = r, V
+            else:
+                vvp[start:stop], self.V[start:stop] = np.linalg.eig(G)
+        self.warm_ready = warm or self.warm_ready
+        return self.vvp
+
+    def radius(self):
+        """
+        return the spectral radius of G(xi) on the grid of the wavenumbers
+        (array of shape (Nx,) or (Nx, Ny)), computed from self.vvp
+        """
+        return np.max(np.abs(self.vvp.reshape((self.Nxi, self.nv))), axis = 1).reshape(self.shape)
+
+    def spectrum(self, xi):
+        """
+        return the eigenvalues of G(xi) for the given wavenumbers
+        (array of shape (n,) in dimension 1 or (n, d)) as an array of shape (n, nv)
+        """
+        xi = np.asarray(xi, dtype = 'float64').reshape((-1, self.d))
+        vp = np.empty((xi.shape[0], self.nv), dtype = 'complex128')
+        for start in range(0, xi.shape[0], self.chunk):
+            stop = min(xi.shape[0], start + self.chunk)
+            G = self.G[:stop-start]
+            phase = np.exp(-1j*np.dot(xi[start:stop], self.v[:, :2].T))
+            np.multiply(phase[:, :, np.newaxis], self.dG[np.newaxis, :, :], out = G)
+            vp[start:stop] = eigvals(G, method = self.method)
+        return vp
+
+    def spectral_density(self, N = 10**6, x_range = (-1.1, 1.1), y_range = (-1.1, 1.1),
+                         bins = 300):
+        """
+        histogram of the eigenvalues in the complex plane for a fine grid of
+        wavenumbers, independent of the grid of self.vxi
+
+        the wavenumbers are generated and solved by chunks (chunk_size complex
+        entries) and each chunk is accumulated in the histogram: the memory
+        does not depend on N and the spectrum is not stored
+
+        Parameters
+        ----------
+
+        N : integer, optional
+            total number of wavenumbers (a uniform grid of [0, 2 pi]^d
+            with about N^(1/d) points in each direction)
+        x_range : a tuple for min and max value of the real part, optional
+        y_range : a tuple for min and max value of the imaginary part, optional
+        bins : integer or tuple of integers, optional
+            number of bins in each direction
+
+        Returns
+        -------
+
+        counts : integer array of shape (ny, nx), the number of eigenvalues in each bin
+
+        """
+        nx, ny = (bins, bins) if np.isscalar(bins) else bins
+        counts = np.zeros((ny*nx,), dtype = 'int64')
+        chunk = max(1, self.chunk_size // self.nv**2)
+        G = np.empty((chunk, self.nv, self.nv), dtype = 'complex128')
+        n = max(2, int(round(N**(1./self.d))))
+        step = 2*np.pi/(n - 1)
+        for start in range(0, n**self.d, chunk):
+            k = np.arange(start, min(n**self.d, start + chunk))
+            xi = step*np.stack(np.unravel_index(k, (n,)*self.d), axis = -1)
+            phase = np.exp(-1j*np.dot(xi, self.v[:, :self.d].T))
+            g = G[:k.size]
+            np.multiply(phase[:, :, np.newaxis], self.dG[np.newaxis, :, :], out = g)
+            vp = eigvals(g, method = self.method).ravel()
+            i = np.floor((vp.real - x_range[0])*nx/(x_range[1] - x_range[0])).astype('int64')
+            j = np.floor((vp.imag - y_range[0])*ny/(y_range[1] - y_range[0])).astype('int64')
+            inside = (i >= 0) & (i < nx) & (j >= 0) & (j < ny)
+            counts += np.bincount(j[inside]*nx + i[inside], minlength = ny*nx)
+        return counts.reshape((ny, nx))
+
+    def adaptive_spectral_radius(self, N0 = 65, xi_min = 2*np.pi*1.e-5,
+                                 margin = 1.e-2, jump = 5.e-2, tol = 1.e-8,
+                                 max_solves = 1000):
+        """
+        compute the spectral radius with an adaptive sampling of the wavenumbers
+        (dimension 1 only)
+
+        as G(-xi) is the conjugate of G(xi), only [0, pi] is sampled:
+        the sampling starts with N0 uniform points, then an interval is split while
+        it is larger than xi_min and
+
+        - the spectral radius at one of its ends is above 1 - margin (dxi/dxi0)^2
+          (a smooth curve cannot exceed 1 inside the interval otherwise)
+        - or the sorted moduli of the eigenvalues differ by more than jump
+          between its ends
+
+        the refinement stops as soon as an unstable wavenumber is found
+        or when max_solves eigenvalue problems have been solved
+        (the intervals closest to instability are split first)
+
+        Returns
+        -------
+
+        rho : the maximum of the spectral radius over the samples
+        stable : boolean, rho <= 1 + tol
+        xi : the sorted wavenumbers
+        r : the spectral radius for each wavenumber
+        nsolve : number of eigenvalue problems solved
+
+        """
+        if self.d != 1:
+            raise NotImplementedError("the adaptive sampling is only available in dimension 1")
+        dxi0 = np.pi/(N0-1)
+        xi = np.linspace(0, np.pi, N0)
+        mod = np.sort(np.abs(self.spectrum(xi)), axis = -1)
+        nsolve = N0
+        while nsolve < max_solves:
+            r = mod[:, -1]
+            if np.max(r) > 1 + tol:
+                # the scheme is unstable
+                break
+            dxi = np.diff(xi)
+            score = np.maximum(r[:-1], r[1:]) + margin*(dxi/dxi0)**2
+            moving = np.max(np.abs(np.diff(mod, axis = 0)), axis = -1) > jump
+            flag = ((score > 1) | moving) & (dxi > xi_min)
+            ind = np.nonzero(flag)[0]
+            if ind.size == 0:
+                break
+            if nsolve + ind.size > max_solves:
+                ind = ind[np.argsort(-score[ind])[:max_solves - nsolve]]
+            new = .5*(xi[ind] + xi[ind+1])
+            nsolve += new.size
+            xi = np.concatenate((xi, new))
+            mod = np.concatenate((mod, np.sort(np.abs(self.spectrum(new)), axis = -1)))
+            order = np.argsort(xi)
+            xi, mod = xi[order], mod[order]
+        r = mod[:, -1]
+        rho = np.max(r)
+        return rho, rho <= 1 + tol, xi, r, nsolve
+
+    def dispersion(self, c = None):
+        """
+        dispersion and dissipation of the physical modes computed from self.vvp
+        (dimension 1 only)
+
+        the eigenvalues are tracked along the wavenumbers, the physical modes
+        are the len(self.conserved) branches starting closest to 1 at xi = 0.
+        A mode exp(i k x) is multiplied by lambda(xi) at each time step with xi = k dx
+
+        Parameters
+        ----------
+
+        c : float, optional
+            velocity of the exact transport equation, lambda = exp(-i c xi / la)
+
+        Returns
+        -------
+
+        dictionary with the arrays
+        'xi' (Nx,), 'branches' (Nx, nv) the tracked eigenvalues,
+        'physical' the indices of the physical branches,
+        'amplification' (Nx, r) the modulus of the physical eigenvalues,
+        'phase_velocity' (Nx, r) the numerical phase velocity -arg(lambda) la / xi,
+        and if c is given, 'phase_error' and 'amplitude_error' (Nx, r)
+        """
+        if self.d != 1:
+            raise NotImplementedError("the dispersion analysis is only available in dimension 1")
+        branches = track_branches(self.vvp.reshape((self.Nxi, self.nv)))
+        i0 = np.argmin(np.abs(self.vxi))
+        physical = np.sort(np.argsort(np.abs(branches[i0] - 1))[:len(self.conserved)])
+        lp = branches[:, physical]
+        phase = np.unwrap(np.angle(lp), axis = 0)
+        # the phase is 0 at xi = 0 for the physical modes
+        phase -= 2*np.pi*np.round(phase[i0]/(2*np.pi))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            velocity = -phase*self.la/self.vxi[:, np.newaxis]
+        velocity[self.vxi == 0] = np.nan
+        res = {'xi': self.vxi,
+               'branches': branches,
+               'physical': physical,
+               'amplification': np.abs(lp),
+               'phase_velocity': velocity}
+        if c is not None:
+            res['phase_error'] = velocity - c
+            res['amplitude_error'] = res['amplification'] - 1
+        return res
+
+    def _pseudospectrum_tile(self, z, nxi):
+        # min over xi of the smallest singular value of z I - G(xi) for the points z
+        res = np.full(z.shape, np.inf)
+        zI = z[:, np.newaxis, np.newaxis, np.newaxis]*np.eye(self.nv)
+        for start in range(0, self.Nxi, nxi):
+            G = self.phase[start:start+nxi, :, np.newaxis]*self.dG[np.newaxis, :, :]
+            sv = smallest_singular_value(zI - G[np.newaxis])
+            np.minimum(res, sv.min(axis = 1), out = res)
+        return res
+
+    def pseudospectrum(self, x_range = (-1.5, 1.5), y_range = (-1.5, 1.5), n = 100, workers = None):
+        """
+        compute the pseudospectrum of the amplification matrices
+
+        sigma(z) = min over xi of the smallest singular value of z I - G(xi):
+        z belongs to the epsilon-pseudospectrum if sigma(z) < epsilon.
+        The grid of z is split in tiles computed in parallel by threads,
+        each tile solves stacks of singular values by chunks of wavenumbers.
+
+        Parameters
+        ----------
+
+        x_range : a tuple for min and max value of the real part, optional
+        y_range : a tuple for min and max value of the imaginary part, optional
+        n : integer or tuple of integers, optional
+            number of points of the grid in each direction
+        workers : integer, optional
+            number of threads (default is the number of cores)
+
+        Returns
+        -------
+
+        x : array of the real parts (nx,)
+        y : array of the imaginary parts (ny,)
+        sigma : array of shape (ny, nx)
+
+        """
+        nx, ny = (n, n) if np.isscalar(n) else n
+        x = np.linspace(x_range[0], x_range[1], nx)
+        y = np.linspace(y_range[0], y_range[1], ny)
+        z = (x[np.newaxis, :] + 1j*y[:, np.newaxis]).ravel()
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        nxi = min(self.Nxi, self.chunk)
+        nz = max(1, min(self.chunk_size // (nxi*self.nv**2), -(-z.size // (4*workers))))
+        tiles = [z[k:k+nz] for k in range(0, z.size, nz)]
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            res = list(executor.map(lambda t: self._pseudospectrum_tile(t, nxi), tiles))
+        return x, y, np.concatenate(res).reshape((ny, nx))
+
+    def spectral_radius(self):
+        """
+        return the maximum of the modulus of the eigenvalues over all the wavenumbers
+        """
+        return np.max(np.abs(self.eigenvalues()))
+
+    def sweep(self, ranges, processes = None, tol = 1.e-8):
+        """
+        compute the spectral radius on a grid of the parameter space
+
+        Parameters
+        ----------
+
+        ranges : dictionary {variable: 1D array of values}
+            the grid is the tensor product of these values,
+            the other parameters keep their current values
+        processes : integer, optional
+            number of worker processes (default is the number of cores)
+        tol : float, optional
+            a point is stable if its spectral radius is below 1 + tol
+
+        Returns
+        -------
+
+        rho : N-dimensional array of the spectral radius (axes in the order of ranges)
+        stable : N-dimensional boolean array
+
+        """
+        names = list(ranges.keys())
+        values = [np.asarray(ranges[name], dtype = 'float64') for name in names]
+        shape = tuple(val.size for val in values)
+        size = int(np.prod(shape))
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        processes = max(1, min(processes, size))
+        sch = copy.deepcopy(self)
+        if processes == 1:
+            rho = np.empty(shape)
+            _sweep_chunk(sch, names, values, rho, 0, size)
+            return rho, rho <= 1 + tol
+        # several chunks per process to balance the load,
+        # the results are written in a shared memory block
+        nchunks = 4*processes
+        bounds = np.linspace(0, size, nchunks + 1).astype('int')
+        shm = shared_memory.SharedMemory(create = True, size = 8*size)
+        try:
+            with multiprocessing.Pool(processes,
+                                      initializer = _sweep_init,
+                                      initargs = (sch, names, values, shm.name, shape)) as pool:
+                pool.map(_sweep_task, zip(bounds[:-1], bounds[1:]))
+            rho = np.ndarray(shape, dtype = 'float64', buffer = shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        return rho, rho <= 1 + tol
+
+
+    def _boundary_unstable(self, sch, names, u, lower, width, tol):
+        # stability verdict at the normalized point u (one batched eigenvalue solve)
+        param = dict(sch.param)
+        for name, val in zip(names, lower + u*width):
+            param[name] = val
+        sch.fix_parameters(param)
+        return sch.spectral_radius() > 1 + tol
+
+    def boundary(self, ranges, start = None, step = 2.e-2, xtol = 1.e-4,
+                 tol = 1.e-8, max_points = 1000):
+        """
+        trace the stability boundary in a plane of the parameter space
+
+        a first boundary point is found by bisection on a segment between a
+        stable and an unstable point, then the curve is followed in both
+        directions with predictor-corrector steps: the predictor moves along
+        the tangent given by the last two points, the corrector is a bisection
+        along the normal. Each verdict is one batched eigenvalue solve over all
+        the wavenumbers. The steps are done in the coordinates normalized by
+        ranges. At the corners of the boundary the corrector is a bisection
+        on the half circle of radius step ahead of the last point.
+
+        Parameters
+        ----------
+
+        ranges : dictionary {variable: (min, max)} of two parameters
+            the other parameters keep their current values
+        start : tuple of two points (stable, unstable), optional
+            the first bisection segment (default is the current values of the
+            parameters and the farthest corner of the box with a different verdict)
+        step : float, optional
+            maximal step of the continuation (normalized coordinates)
+        xtol : float, optional
+            tolerance of the bisections (normalized coordinates)
+        tol : float, optional
+            a point is stable if its spectral radius is below 1 + tol
+        max_points : integer, optional
+            maximal number of points in each direction
+
+        Returns
+        -------
+
+        points : array of shape (n, 2) of the boundary ordered along the curve
+        nsolve : number of spectral radius evaluations
+
+        """
+        names = list(ranges.keys())
+        if len(names) != 2:
+            raise ValueError("the boundary is traced in a plane: two parameters are needed")
+        lower = np.array([ranges[name][0] for name in names], dtype = 'float64')
+        width = np.array([ranges[name][1] for name in names], dtype = 'float64') - lower
+        sch = copy.deepcopy(self)
+        nsolve = [0]
+
+        def unstable(u):
+            nsolve[0] += 1
+            return self._boundary_unstable(sch, names, u, lower, width, tol)
+
+        def bisect(a, b):
+            # a stable, b unstable
+            while np.linalg.norm(b - a) > xtol:
+                c = .5*(a + b)
+                if unstable(c):
+                    b = c
+                else:
+                    a = c
+            return .5*(a + b)
+
+        if start is None:
+            a = np.clip((np.array([self.param[name] for name in names]) - lower)/width, 0, 1)
+            ua = unstable(a)
+            b = None
+            for corner in sorted(itertools.product((0., 1.), repeat = 2),
+                                 key = lambda c: -np.linalg.norm(np.array(c) - a)):
+                if unstable(np.array(corner)) != ua:
+                    b = np.array(corner)
+                    break
+            if b is None:
+                raise ValueError("no stability boundary found in the box")
+            if ua:
+                a, b = b, a
+        else:
+            a, b = [(np.asarray(p, dtype = 'float64') - lower)/width for p in start]
+        p0 = bisect(a, b)
+        n0 = (b - a)/np.linalg.norm(b - a)
 
+        def follow(t):
+            p, n = p0, n0
+            points = []
+            h = step
+            while len(points) < max_points:
+                q = p + h*t
+                if np.any(q < 0) or np.any(q > 1):
+                    break
+                if unstable(q):
+                    a, b = q - h*n, q
+                    ok = not unstable(a)
+                else:
+                    a, b = q, q + h*n
+                    ok = unstable(b)
+                if ok:
+                    p_new = bisect(a, b)
+                else:
+                    # corner: bisection on the half circle of radius h ahead of p
+                    arc = lambda theta: p + h*(np.cos(theta)*t + np.sin(theta)*n)
+                    lo, hi = -.5*np.pi, .5*np.pi
+                    if unstable(arc(lo)) or not unstable(arc(hi)):
+                        h *= .5
+                        if h < 4*xtol:
+                            break
+                        continue
+                    while h*(hi - lo) > xtol:
+                        mid = .5*(lo + hi)
+                        if unstable(arc(mid)):
+                            hi = mid
+                        else:
+                            lo = mid
+                    p_new = arc(.5*(lo + hi))
+                    if np.any(p_new < 0) or np.any(p_new > 1):
+                        break
+                tnew = (p_new - p)/np.linalg.norm(p_new - p)
+                # the normal points to the unstable side
+                nnew = np.array([-tnew[1], tnew[0]])
+                if np.dot(nnew, n) < 0:
+                    nnew = -nnew
+                p, t, n = p_new, tnew, nnew
+                points.append(p)
+                if len(points) > 2 and np.linalg.norm(p - p0) < h:
+                    # closed curve
+                    break
+                h = min(step, 2*h)
+            return points
+
+        t0 = np.array([-n0[1], n0[0]])
+        forward = follow(t0)
+        closed = len(forward) > 2 and np.linalg.norm(forward[-1] - p0) < step
+        backward = [] if closed else follow(-t0)
+        u = np.array(backward[::-1] + [p0] + forward)
+        return lower + u*width, nsolve[0]
 
 class D1Q2(scheme):
     _name = 'D1Q2'
@@ -47,6 +809,10 @@ class D1Q2(scheme):
     def _define_scheme(self):
         self.v = np.array([[-1], [1]])
         self.P = sp.Matrix([1, LA*X])
+        s, c = sp.symbols('s, c')
+        self.R_sym = sp.Matrix([[1, 0], [s*c, 1-s]])
+        self.conserved = [0]
+        self.moments = ['u']
 
         self.param = {'la': 1., 'c': 1., 's': 1.}
         self.p_model = [
@@ -82,15 +848,6 @@ class D1Q2(scheme):
             },
         ]
 
-    def compute_eqeq(self):
-        c, la, s = self.param['c'], self.param['la'], self.param['s']
-        d = (1./s-.5) * (la**2 - c**2)
-        self.eqeq = """
-Equivalent equation        du       du              d^2u
-                           -- + {0:3.1f} -- ={1:8.1e} dt ---- + O(dt^2).
-                           dt       dx              dx^2
-        """.format(c, d)
-
     def fix_parameters(self, param):
         self.la = self.param['la'] = param['la']
         self.c = self.param['c'] = param['c']
@@ -100,10 +857,15 @@ Equivalent equation        du       du              d^2u
 
 class D1Q3o(scheme):
     _name = 'D1Q3 (1)'
+    eqeq_order = 3
 
     def _define_scheme(self):
         self.v = np.array([[-1], [0], [1]])
         self.P = sp.Matrix([1, LA*X, LA**2*X**2/2])
+        sa, sb, ca, cb = sp.symbols('sa, sb, ca, cb')
+        self.R_sym = sp.Matrix([[1, 0, 0], [sa*ca, 1-sa, 0], [sb*cb, 0, 1-sb]])
+        self.conserved = [0]
+        self.moments = ['u']
 
         self.param = {'la': 1., 'ca': 1., 'sa': 1., 'cb': 1., 'sb': 1.}
         self.p_model = [
@@ -159,25 +921,6 @@ class D1Q3o(scheme):
             },
         ]
 
-    def compute_eqeq(self):
-        ca, cb, la, sa, sb = self.param['ca'], self.param['cb'], self.param['la'], self.param['sa'], self.param['sb']
-        d = (1./sa-.5) * (2*cb*la**2 - ca**2)
-        sigmaa, sigmab = 1./sa-.5, 1./sb-.5
-        e = la**2 * (1 - 12 * sigmab * sigmaa) + 2 * ca**2 * (1 - 12 * sigmaa**2) + 3 * cb * (4*sigmab*sigmaa + 8*sigmaa**2 - 1)
-        self.eqeq = """
-Equivalent equation        du       du              d^2u                d^3u
-                           -- + {0:3.1f} -- ={1:8.1e} dt ---- +{2:8.1e} dt^2 ---- O(dt^3).
-                           dt       dx              dx^2                dx^3
-        """.format(ca, d, e)
-
-        """
-        dt^2 (d^3u/dx^3) ca/12 * (
-        la**2 * (1 - 12 * sigmab * sigmaa) + 2 * ca**2 * (1 - 12 * sigmaa**2)
-        + 3 * cb * (4*sigmab*sigmaa + 8*sigmaa**2 - 1)
-        )
-        """
-
-
     def fix_parameters(self, param):
         self.la = self.param['la'] = param['la']
         self.ca = self.param['ca'] = param['ca']
@@ -194,6 +937,10 @@ class D1Q3d(scheme):
     def _define_scheme(self):
         self.v = np.array([[-1], [0], [1]])
         self.P = sp.Matrix([1, LA*X, LA**2*X**2/2])
+        s, c = sp.symbols('s, c')
+        self.R_sym = sp.Matrix([[1, 0, 0], [0, 1, 0], [s*c, 0, 1-s]])
+        self.conserved = [0, 1]
+        self.moments = ['u', 'v']
 
         self.param = {'la': 1., 'c': 1., 's': 1.}
         self.p_model = [
@@ -229,18 +976,214 @@ class D1Q3d(scheme):
             },
         ]
 
-    def compute_eqeq(self):
-        c, la, s = self.param['c'], self.param['la'], self.param['s']
-        d = (1./s-.5) * (la**2 - 2*c**2)
-        self.eqeq = """
-Equivalent equations       du   dv            dv       du                d^2u
-                           -- + -- = O(dt^2), -- + {0:3.1f} --  = {1:8.1e} dt ---- + O(dt^2).
-                           dt   dx            dt       dx                dx^2
-        """.format(2*c, d)
-
     def fix_parameters(self, param):
         self.la = self.param['la'] = param['la']
         self.c = self.param['c'] = param['c']
         self.s = self.param['s'] = param['s']
         self.R[:] = np.array([[1,0,0], [0,1,0], [self.s*self.c, 0, 1-self.s]])
         self.fix_parameters_generic()
+
+
+class D2Q5(scheme):
+    _name = 'D2Q5'
+
+    def _define_scheme(self):
+        self.v = np.array([[0, 0], [1, 0], [0, 1], [-1, 0], [0, -1]])
+        self.P = sp.Matrix([1, LA*X, LA*Y, (X**2+Y**2)/2, (X**2-Y**2)/2])
+        s1, s2, cx, cy = sp.symbols('s1, s2, cx, cy')
+        self.R_sym = sp.Matrix([[1, 0, 0, 0, 0],
+                                [s1*cx, 1-s1, 0, 0, 0],
+                                [s1*cy, 0, 1-s1, 0, 0],
+                                [s2/2, 0, 0, 1-s2, 0],
+                                [0, 0, 0, 0, 1-s2]])
+        self.conserved = [0]
+        self.moments = ['u']
+
+        self.param = {'la': 1., 'cx': 0., 'cy': 0., 's1': 1., 's2': 1.}
+        self.p_model = [
+            {
+                'type': 'slider',
+                'variable': 's1',
+                'description': r'relaxation parameter $s_1$',
+                'value': self.param['s1'],
+                'min': 0.,
+                'max': 2.,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 's2',
+                'description': r'relaxation parameter $s_2$',
+                'value': self.param['s2'],
+                'min': 0.,
+                'max': 2.,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 'cx',
+                'description': r'equilibrium parameter $c_x$',
+                'value': self.param['cx'],
+                'min': -1.,
+                'max': 1.,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 'cy',
+                'description': r'equilibrium parameter $c_y$',
+                'value': self.param['cy'],
+                'min': -1.,
+                'max': 1.,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 'la',
+                'description': r'scheme velocity $\lambda$',
+                'value': self.param['la'],
+                'min': 0.,
+                'max': 1.5,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+        ]
+
+    def fix_parameters(self, param):
+        self.la = self.param['la'] = param['la']
+        self.cx = self.param['cx'] = param['cx']
+        self.cy = self.param['cy'] = param['cy']
+        self.s1 = self.param['s1'] = param['s1']
+        self.s2 = self.param['s2'] = param['s2']
+        s1, s2 = self.s1, self.s2
+        self.R[:] = np.array([[1, 0, 0, 0, 0],
+                              [s1*self.cx, 1-s1, 0, 0, 0],
+                              [s1*self.cy, 0, 1-s1, 0, 0],
+                              [.5*s2, 0, 0, 1-s2, 0],
+                              [0, 0, 0, 0, 1-s2]])
+        self.fix_parameters_generic()
+
+
+class D2Q9(scheme):
+    _name = 'D2Q9'
+
+    def _define_scheme(self):
+        self.v = np.array([[0, 0], [1, 0], [0, 1], [-1, 0], [0, -1],
+                           [1, 1], [-1, 1], [-1, -1], [1, -1]])
+        self.P = sp.Matrix([1, LA*X, LA*Y,
+                            3*(X**2+Y**2)-4,
+                            (9*(X**2+Y**2)**2-21*(X**2+Y**2)+8)/2,
+                            3*X*(X**2+Y**2)-5*X, 3*Y*(X**2+Y**2)-5*Y,
+                            X**2-Y**2, X*Y])
+        s_mu, s_es, s_q, s_eta, ux, uy = sp.symbols('s_mu, s_es, s_q, s_eta, ux, uy')
+        s = [0, 0, 0, s_mu, s_es, s_q, s_q, s_eta, s_eta]
+        J = sp.zeros(9, 9)
+        J[0, 0] = J[1, 1] = J[2, 2] = 1
+        J[3, :3] = sp.Matrix([[-2, 6*ux/LA**2, 6*uy/LA**2]])
+        J[4, :3] = sp.Matrix([[1, -6*ux/LA**2, -6*uy/LA**2]])
+        J[5, 1] = J[6, 2] = -1/LA
+        J[7, 1:3] = sp.Matrix([[2*ux/LA**2, -2*uy/LA**2]])
+        J[8, 1:3] = sp.Matrix([[uy/LA**2, ux/LA**2]])
+        self.R_sym = sp.diag(*[1-sk for sk in s]) + sp.diag(*s)*J
+        self.conserved = [0, 1, 2]
+        self.moments = ['rho', 'qx', 'qy']
+
+        self.param = {'la': 1., 'ux': 0., 'uy': 0.,
+                      's_mu': 1.5, 's_es': 1.5, 's_q': 1.5, 's_eta': 1.5}
+        self.p_model = [
+            {
+                'type': 'slider',
+                'variable': 's_mu',
+                'description': r'relaxation parameter $s_\mu$',
+                'value': self.param['s_mu'],
+                'min': 0.,
+                'max': 2.,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 's_es',
+                'description': r'relaxation parameter $s_\varepsilon$',
+                'value': self.param['s_es'],
+                'min': 0.,
+                'max': 2.,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 's_q',
+                'description': r'relaxation parameter $s_q$',
+                'value': self.param['s_q'],
+                'min': 0.,
+                'max': 2.,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 's_eta',
+                'description': r'relaxation parameter $s_\eta$',
+                'value': self.param['s_eta'],
+                'min': 0.,
+                'max': 2.,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 'ux',
+                'description': r'mean velocity $u_x$',
+                'value': self.param['ux'],
+                'min': -.5,
+                'max': .5,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 'uy',
+                'description': r'mean velocity $u_y$',
+                'value': self.param['uy'],
+                'min': -.5,
+                'max': .5,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+            {
+                'type': 'slider',
+                'variable': 'la',
+                'description': r'scheme velocity $\lambda$',
+                'value': self.param['la'],
+                'min': 0.,
+                'max': 1.5,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            },
+        ]
+
+    def fix_parameters(self, param):
+        for k in self.param:
+            self.param[k] = param[k]
+        self.la = self.param['la']
+        ux, uy, la = self.param['ux'], self.param['uy'], self.la
+        s = np.array([0., 0., 0.,
+                      self.param['s_mu'], self.param['s_es'],
+                      self.param['s_q'], self.param['s_q'],
+                      self.param['s_eta'], self.param['s_eta']])
+        # jacobian of the equilibrium with respect to (rho, qx, qy)
+        # for a mean flow of density 1 and velocity (ux, uy)
+        J = np.zeros((self.nv, self.nv))
+        J[0, 0] = J[1, 1] = J[2, 2] = 1.
+        J[3, :3] = [-2, 6*ux/la**2, 6*uy/la**2]
+        J[4, :3] = [1, -6*ux/la**2, -6*uy/la**2]
+        J[5, 1] = J[6, 2] = -1./la
+        J[7, 1:3] = [2*ux/la**2, -2*uy/la**2]
+        J[8, 1:3] = [uy/la**2, ux/la**2]
+        self.R[:] = np.diag(1-s) + s[:, np.newaxis]*J
+        self.fix_parameters_generic()
@@ -0,0 +1,156 @@
+import numpy as np
+import sympy as sp
+
+from .Oned import scheme, X, Y, Z, LA
+
+def velocity(k, dim):
+    """
+    return the velocity numbered k in dimension dim (numbering of pyLBM)
+    """
+    if dim == 1:
+        return ((k + 1)//2 * (-1)**(k + 1),)
+    if dim == 2:
+        if k == 0:
+            return (0, 0)
+        ring = [(1, 0), (0, 1), (-1, 0), (0, -1),
+                (1, 1), (-1, 1), (-1, -1), (1, -1)]
+        if k <= len(ring):
+            return ring[k - 1]
+    raise ValueError("velocity {0} is not available in dimension {1}".format(k, dim))
+
+def _as_list(a):
+    if isinstance(a, (list, tuple)):
+        return list(a)
+    return [a]
+
+class dictionary_scheme(scheme):
+    """
+    scheme built from a dictionary of pyLBM
+
+    Parameters
+    ----------
+
+    dico : dictionary with the key 'schemes' (list of elementary schemes) or
+        one elementary scheme; each elementary scheme gives 'velocities',
+        'conserved_moments', 'polynomials', 'relaxation_parameters' and 'equilibrium'.
+        The numerical values of the symbols are given in 'parameters' (optional),
+        the dimension in 'dim' (optional, 2 if Y is used in the polynomials)
+    state : dictionary {conserved moment: value}, optional
+        state around which the equilibrium is linearized
+        (the numerical 'init' values of the dictionary by default, 0 otherwise)
+    Nx, method, Ny, chunk_size : see scheme
+
+    All the symbolic work (moment matrix, relaxation matrix linearized around
+    state) is done once at construction and compiled into numerical functions
+    of the parameters.
+
+    """
+    _name = 'pyLBM scheme'
+    _compiled = ('_M', '_R', '_eqeq')
+
+    def __init__(self, dico, state = None, Nx = 200, method = 'auto', Ny = None, chunk_size = 2**22):
+        self.dico = dico
+        self.state = {} if state is None else state
+        scheme.__init__(self, Nx = Nx, method = method, Ny = Ny, chunk_size = chunk_size)
+
+    def _define_scheme(self):
+        dico = self.dico
+        schemes = dico['schemes'] if 'schemes' in dico else [dico]
+        parameters = dico.get('parameters', {})
+        polynomials = [[sp.sympify(p) for p in s['polynomials']] for s in schemes]
+        dim = dico.get('dim', None)
+        if dim is None:
+            dim = 2 if any(Y in p.free_symbols for P in polynomials for p in P) else 1
+        # conserved moments and linearization state
+        conserved = []
+        state = {}
+        for s in schemes:
+            for m in _as_list(s['conserved_moments']):
+                conserved.append(m)
+                value = self.state.get(m, s.get('init', {}).get(m, 0.))
+                state[m] = value if isinstance(value, (int, float)) else 0.
+        # velocities, moment matrix and relaxation matrix
+        velocities, blocks, s_list, J_rows = [], [], [], []
+        for s, P in zip(schemes, polynomials):
+            v = [velocity(k, dim) for k in s['velocities']]
+            velocities += v
+            Mb = sp.Matrix(len(P), len(v),
+                           lambda i, j: P[i].subs({X: v[j][0],
+                                                   Y: v[j][min(1, dim-1)],
+                                                   Z: v[j][min(2, dim-1)]}))
+            blocks.append(Mb)
+            for r, eq in zip(s['relaxation_parameters'], s['equilibrium']):
+                s_list.append(sp.sympify(r))
+                eq = sp.sympify(eq)
+                J_rows.append([sp.diff(eq, m).subs(state) for m in conserved])
+        nv = len(velocities)
+        self.v = np.array(velocities)
+        self.M_sym = sp.diag(*blocks)
+        # the conserved moments are the first moments of each elementary scheme
+        position = []
+        k0 = 0
+        for s, P in zip(schemes, polynomials):
+            position += [k0 + i for i in range(len(_as_list(s['conserved_moments'])))]
+            k0 += len(P)
+        self.conserved = position
+        self.moments = [str(m) for m in conserved]
+        # linearized relaxation:
+        # m_k <- (1-s_k) m_k + s_k sum_j dmeq_k/dm_j m_j
+        self.R_sym = sp.zeros(nv, nv)
+        for k in range(nv):
+            self.R_sym[k, k] = 1 - s_list[k]
+            for j, pos in enumerate(position):
+                self.R_sym[k, pos] += s_list[k] * J_rows[k][j]
+        # parameters of the scheme
+        symbols = (self.M_sym.free_symbols | self.R_sym.free_symbols) - {X, Y, Z}
+        relaxation_symbols = set().union(*[r.free_symbols for r in s_list])
+        self.symbols = [LA] + sorted(symbols - {LA}, key = str)
+        self.names = ['la' if sym == LA else str(sym) for sym in self.symbols]
+        self.param = {}
+        self.p_model = []
+        for sym, name in zip(self.symbols, self.names):
+            value = parameters.get(sym, 1.)
+            value = float(value) if isinstance(value, (int, float)) else 1.
+            self.param[name] = value
+            if sym in relaxation_symbols:
+                vmin, vmax = 0., 2.
+            else:
+                vmin, vmax = min(0., -2*abs(value)), max(2*abs(value), 1.)
+                if value >= 0:
+                    vmin = 0.
+            self.p_model.append({
+                'type': 'slider',
+                'variable': name,
+                'description': r'parameter ${0}$'.format(sp.latex(sym)),
+                'value': value,
+                'min': vmin,
+                'max': vmax,
+                'step': 0.01,
+                'readout_format': '4.2f',
+            })
+
+    def _compile_moments(self):
+        self._M = sp.lambdify(self.symbols, self.M_sym, 'numpy')
+        self._R = sp.lambdify(self.symbols, self.R_sym, 'numpy')
+
+    def _eqeq_symbols(self):
+        return self.names, self.symbols
+
+    def fix_parameters(self, param):
+        for name in self.names:
+            self.param[name] = param.get(name, self.param[name])
+        self.la = self.param['la']
+        values = [self.param[name] for name in self.names]
+        self.R[:] = self._R(*values)
+        self.M[:] = self._M(*values)
+        self.fix_parameters_generic()
+
+    def fix_parameters_generic(self):
+        self.iM[:] = np.linalg.inv(self.M)
+        self.dG[:] = np.dot(self.iM, np.dot(self.R, self.M))
+
+def from_dictionary(dico, state = None, **kwargs):
+    """
+    return the scheme described by a dictionary of pyLBM (see dictionary_scheme)
+    """
+    return dictionary_scheme(dico, state = state, **kwargs)
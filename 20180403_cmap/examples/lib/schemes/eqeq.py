@@ -0,0 +1,178 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import numpy as np
+import sympy as sp
+
+# scheme velocity and symbols of the space derivatives
+LA, DX, DY = sp.symbols('LA, DX, DY')
+
+# increase when the derivation changes to invalidate the cache on disk
+_version = 1
+
+default_cache_dir = os.environ.get('LBM_EQEQ_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'lbm_eqeq'))
+
+def _product(A, B, order):
+    # product of two power series in the space step given by the lists of their matrix coefficients
+    C = [sp.zeros(A[0].shape[0], B[0].shape[1]) for p in range(order + 1)]
+    for p in range(order + 1):
+        for q in range(p + 1):
+            C[p] += A[q]*B[p-q]
+    return [c.applyfunc(sp.expand) for c in C]
+
+def derive(v, M, R, conserved, order = 2):
+    """
+    derive the equivalent equations of a linear lattice Boltzmann scheme
+
+    the moments m = M f are relaxed by m* = R m and the distributions are
+    transported along the velocities v. The non conserved moments are written
+    as a formal power series of the conserved moments W (invariant manifold)
+    and the time shift operator T of W is expanded in powers of the space step.
+
+    Parameters
+    ----------
+
+    v : array of the velocities (nv, d)
+    M : sympy matrix of the moments (function of LA and of the parameters)
+    R : sympy matrix of the relaxation (the conserved moments are not modified)
+    conserved : list of the indices of the conserved moments
+    order : integer, optional
+        order of the equivalent equations
+
+    Returns
+    -------
+
+    list of the terms (p, i, j, (ax, ay), coefficient) such that
+
+    dW_i/dt = sum dt^(p-1) coefficient d^p W_j / dx^ax dy^ay + O(dt^order)
+
+    """
+    nv, d = M.shape[0], v.shape[1]
+    other = [k for k in range(nv) if k not in conserved]
+    r = len(conserved)
+    dv = [-(int(v[k, 0])*DX + (int(v[k, 1])*DY if d > 1 else 0)) for k in range(nv)]
+    iM = M.inv(method = 'LU').applyfunc(sp.cancel)
+    A = []
+    for p in range(order + 1):
+        E = sp.diag(*[dvk**p/sp.factorial(p) for dvk in dv])
+        A.append((M*E*iM*R).applyfunc(sp.expand))
+    AWW = [a.extract(conserved, conserved) for a in A]
+    AWY = [a.extract(conserved, other) for a in A]
+    AYW = [a.extract(other, conserved) for a in A]
+    AYY = [a.extract(other, other) for a in A]
+    iS = (sp.eye(len(other)) - AYY[0]).inv(method = 'LU').applyfunc(sp.cancel)
+    Phi = [(iS*AYW[0]).applyfunc(sp.cancel)]
+    T = [sp.eye(r)]
+    for p in range(1, order + 1):
+        Tp = AWW[p]
+        for q in range(1, p + 1):
+            Tp += AWY[q]*Phi[p-q]
+        T.append(Tp.applyfunc(sp.expand))
+        rhs = AYW[p]
+        for q in range(1, p + 1):
+            rhs += AYY[q]*Phi[p-q]
+        for q in range(p):
+            rhs -= Phi[q]*T[p-q]
+        Phi.append((iS*rhs).applyfunc(lambda e: sp.expand(sp.cancel(e))))
+    # log(T) = sum_k (-1)^(k+1) (T - I)^k / k
+    N = [sp.zeros(r, r)] + T[1:]
+    Nk = N
+    logT = [sp.zeros(r, r) for p in range(order + 1)]
+    for k in range(1, order + 1):
+        for p in range(order + 1):
+            logT[p] += sp.Rational((-1)**(k+1), k)*Nk[p]
+        Nk = _product(Nk, N, order)
+    # dW/dt = log(T)/dt W with dt = dx/LA
+    terms = []
+    gens = (DX, DY) if d > 1 else (DX,)
+    for p in range(1, order + 1):
+        for i in range(r):
+            for j in range(r):
+                expr = sp.expand(LA**p*logT[p][i, j])
+                if expr == 0:
+                    continue
+                poly = sp.Poly(expr, *gens)
+                for monom, coeff in zip(poly.monoms(), poly.coeffs()):
+                    coeff = sp.factor(sp.cancel(coeff))
+                    if coeff != 0:
+                        alpha = tuple(monom) + (0,)*(2 - len(monom))
+                        terms.append((p, i, j, alpha, coeff))
+    return terms
+
+def _key(v, M, R, conserved, order):
+    # the pickles of sympy expressions depend on the version of sympy
+    data = repr((_version, sp.__version__, np.asarray(v).tolist(), sp.srepr(M), sp.srepr(R), list(conserved), order))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def derive_cached(v, M, R, conserved, order = 2, cache_dir = None):
+    """
+    same as derive, the result is stored on disk in cache_dir
+    with a key given by a hash of the scheme definition
+    """
+    cache_dir = default_cache_dir if cache_dir is None else cache_dir
+    filename = os.path.join(cache_dir, _key(v, M, R, conserved, order) + '.pkl')
+    try:
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        # missing or unreadable file: computed again
+        pass
+    terms = derive(v, M, R, conserved, order)
+    try:
+        os.makedirs(cache_dir, exist_ok = True)
+        # unique temporary file: several threads can derive the same key
+        with tempfile.NamedTemporaryFile(dir = cache_dir, suffix = '.tmp', delete = False) as f:
+            pickle.dump(terms, f)
+        os.replace(f.name, filename)
+    except OSError:
+        pass
+    return terms
+
+class equivalent_equations():
+    """
+    equivalent equations of a scheme with compiled coefficients
+
+    Parameters
+    ----------
+
+    terms : list of the terms returned by derive
+    symbols : list of the sympy symbols of the parameters
+    moments : list of the names of the conserved moments
+    order : integer, order of the equivalent equations
+    dim : integer, optional, dimension of the scheme
+
+    """
+    def __init__(self, terms, symbols, moments, order, dim = 1):
+        self.terms = terms
+        self.symbols = symbols
+        self.moments = moments
+        self.order = order
+        self.dim = dim
+        self.f = sp.lambdify(symbols, [t[4] for t in terms], 'numpy')
+
+    def coefficients(self, values):
+        """
+        return the numerical values of the coefficients for the parameters values
+        """
+        return np.array(self.f(*values), dtype = 'float64').reshape((-1,))
+
+    def format(self, values):
+        """
+        return the equivalent equations as a string
+        """
+        coeffs = self.coefficients(values)
+        lines = ["", "Equivalent equations"]
+        for i, m in enumerate(self.moments):
+            line = "    d{0}/dt =".format(m)
+            for (p, ii, j, alpha, expr), c in zip(self.terms, coeffs):
+                if ii != i or c == 0:
+                    continue
+                dt = "" if p == 1 else (" dt" if p == 2 else " dt^{0}".format(p-1))
+                der = "d{0}{1}/".format('' if p == 1 else '^{0}'.format(p), self.moments[j])
+                der += ''.join(['d' + x + ('' if a == 1 else '^{0}'.format(a))
+                                for x, a in zip('xy'[:self.dim], alpha) if a > 0])
+                line += " {0:+9.2e}{1} {2}".format(c, dt, der)
+            lines.append(line + " + O(dt^{0})".format(self.order))
+        return '\n'.join(lines) + '\n'
@@ -1,9 +1,124 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import functools
+import queue
+import threading
 import numpy as np
 from . import viewers
 from . import pyWiGL
 
+class spectrum_cache():
+    """
+    bounded LRU cache of the spectra, of the equivalent equations
+    and of the grids of the pseudospectra
+
+    Parameters
+    ----------
+
+    max_bytes : integer, optional
+        memory cap of the stored spectra (default value is 64 MB)
+
+    """
+    def __init__(self, max_bytes = 2**26):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        """
+        return the tuple (vvp, eqeq, sigma) stored for key (None if not found)
+        """
+        with self.lock:
+            value = self.data.get(key, None)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.data.move_to_end(key)
+        return value
+
+    def put(self, key, vvp, eqeq, sigma = None):
+        """
+        store a copy of the spectrum vvp, the string eqeq and the grid sigma
+        of the pseudospectra (if computed), the least recently used entries
+        are removed above the memory cap
+        """
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                return
+            self.data[key] = (vvp.copy(), eqeq, sigma)
+            self.nbytes += self._nbytes(self.data[key])
+            while self.nbytes > self.max_bytes and len(self.data) > 1:
+                self.nbytes -= self._nbytes(self.data.popitem(last = False)[1])
+
+    def _nbytes(self, value):
+        vvp, eqeq, sigma = value
+        return vvp.nbytes + (0 if sigma is None else sigma.nbytes)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.data),
+                'nbytes': self.nbytes}
+
 class graphique():
-    def __init__(self, scheme, viewer = 'bokeh'):
+    """
+    interactive plot of the eigenvalues of the amplification matrices
+
+    Parameters
+    ----------
+
+    scheme : the scheme (see schemes.Oned)
+    viewer : string, optional (default is 'bokeh')
+    cache_size : integer, optional
+        memory cap in bytes of the cache of the visited spectra
+    prefetch : boolean, optional
+        if True, the spectra of the neighbouring slider positions
+        (+/- 1 and 2 steps) are computed in background when the plot is idle
+    prefetch_workers : integer, optional
+        number of threads used by the prefetch
+    prefetch_size : integer, optional
+        memory cap in bytes of the prefetched spectra
+    dispersion : boolean, optional
+        if True, the amplification factor and the phase velocity of the
+        physical modes are plotted next to the spectrum (dimension 1 only)
+    pseudospectra : list of floats, optional
+        levels epsilon of the pseudospectra drawn under the eigenvalues
+        (the points z of the grid where the smallest singular value of
+        z I - G(xi) is below epsilon for some xi)
+    pseudospectra_n : integer, optional
+        number of points of the grid of the pseudospectra in each direction
+    density : integer, optional
+        if given, the eigenvalues for density wavenumbers (in total) are
+        drawn as a histogram image of the complex plane instead of points
+        (see scheme.spectral_density, no prefetch and no dispersion plot)
+    density_bins : integer, optional
+        number of bins of the histogram in each direction
+
+    """
+    def __init__(self, scheme, viewer = 'bokeh', cache_size = 2**26,
+                 prefetch = True, prefetch_workers = 2, prefetch_size = 2**24,
+                 dispersion = False, pseudospectra = None, pseudospectra_n = 60,
+                 density = None, density_bins = 300):
         self.viewer = viewers.list_viewers.get(viewer, None)
         if self.viewer is None:
             print("Unknown viewer (matplotlib by default)")
@@ -12,12 +127,106 @@ class graphique():
                 print("\t{0}".format(v))
             self.viewer = viewers.list_viewers['matplotlib']
         self.scheme = scheme
+        self.density = density
+        self.density_bins = density_bins
+        self.dispersion = dispersion and scheme.d == 1 and density is None
+        self.pseudospectra = [] if pseudospectra is None else sorted(pseudospectra, reverse = True)
+        self.pseudospectra_n = pseudospectra_n
+        self.cache = spectrum_cache(cache_size)
         self.g = pyWiGL.interactive_graph()
+        self.steps = {}
+        self.bounds = {}
         for d in self.scheme.p_model:
             self.g.add_parameter(d)
+            self.steps[d['variable']] = d.get('step', (d['max']-d['min'])/100)
+            self.bounds[d['variable']] = (d['min'], d['max'])
+        self._init_prefetch(prefetch and density is None, prefetch_workers, prefetch_size)
         self._init_graph()
 
+    def _init_prefetch(self, prefetch, workers, size):
+        self.prefetched = spectrum_cache(size)
+        self.generation = 0
+        self.futures = []
+        self.executor = None
+        if prefetch:
+            self.executor = ThreadPoolExecutor(max_workers = workers)
+            # each task borrows its own copy of the scheme, the copies solve
+            # small chunks to check the cancellation often
+            self.schemes = queue.Queue()
+            for k in range(workers):
+                sch = copy.deepcopy(self.scheme)
+                sch.chunk = min(sch.chunk, 2**12)
+                self.schemes.put(sch)
+
+    def key(self, param):
+        """
+        quantize the parameters on the steps of the sliders
+        """
+        return tuple(int(round(param[v]/self.steps[v])) for v in sorted(self.steps))
+
+    def neighbours(self, param):
+        """
+        return the parameters located at +/- 1 and 2 steps of param
+        (one parameter is modified at a time)
+        """
+        key = dict(zip(sorted(self.steps), self.key(param)))
+        for d in (-1, 1, -2, 2):
+            for v in self.steps:
+                p = dict(param)
+                p[v] = (key[v] + d)*self.steps[v]
+                if self.bounds[v][0] <= p[v] <= self.bounds[v][1]:
+                    yield p
+
+    def cancel_prefetch(self):
+        """
+        cancel the pending prefetch tasks
+        """
+        self.generation += 1
+        for f in self.futures:
+            f.cancel()
+        self.futures = []
+
+    def prefetch(self, param):
+        """
+        compute in background the spectra of the neighbours of param
+        """
+        self.cancel_prefetch()
+        if self.executor is None:
+            return
+        for p in self.neighbours(param):
+            key = self.key(p)
+            if key not in self.cache and key not in self.prefetched:
+                self.futures.append(self.executor.submit(self._prefetch_task, self.generation, key, p))
+
+    def _prefetch_task(self, generation, key, param):
+        # the generation is checked before each stage and each chunk of the
+        # eigenvalues: a running task stops as soon as the prefetch is cancelled
+        if generation != self.generation:
+            return
+        sch = self.schemes.get()
+        try:
+            sch.fix_parameters(param)
+            sch.compute_eqeq()
+            if generation != self.generation:
+                return
+            if sch.eigenvalues(warm = True, cancel = lambda: generation != self.generation) is None:
+                return
+            # the pseudospectra are not prefetched: they are computed by update
+            self.prefetched.put(key, sch.vvp, sch.eqeq)
+        finally:
+            self.schemes.put(sch)
+
+    def close(self):
+        """
+        stop the prefetch
+        """
+        self.cancel_prefetch()
+        if self.executor is not None:
+            self.executor.shutdown(wait = False)
+            self.executor = None
+
     def _init_graph(self):
+        self.scheme.fix_parameters(self.scheme.param)
         self.scheme.eigenvalues()
         self.fig = self.viewer.Fig(x_range = (-1.1, 1.1),
                                    y_range = (-1.1, 1.1),
@@ -29,11 +238,23 @@ class graphique():
                        title_size = 20,
                        title_color = 'black',
                        title_align = 'center')
-        self.points = self.fig.scatter(np.real(self.scheme.vvp), np.imag(self.scheme.vvp),
-                                       color = 'orange',
-                                       marker = 'circle',
-                                       size = 5,
-                                       alpha = 0.5)
+        self.levels = []
+        for k, (x, y) in enumerate(self._pseudospectra_points(self._sigma(self.scheme))):
+            self.levels.append(self.fig.scatter(x, y,
+                                                color = 'navy',
+                                                marker = 'square',
+                                                size = 3,
+                                                alpha = 0.1 + 0.2*k/len(self.pseudospectra)))
+        if self.density is None:
+            self.points = self.fig.scatter(np.real(self.scheme.vvp), np.imag(self.scheme.vvp),
+                                           color = 'orange',
+                                           marker = 'circle',
+                                           size = 5,
+                                           alpha = 0.5)
+        else:
+            self.image = self.fig.image(self._density_image(self._density()),
+                                        (-1.1, 1.1), (-1.1, 1.1),
+                                        v_range = (0, 1), palette = 'magma')
         t = np.linspace(0, 2*np.pi, 1000)
         self.fig.line(np.cos(t), np.sin(t),
                       line_width = 2,
@@ -41,16 +262,365 @@ class graphique():
                       line_alpha = 1)
 
         self.fig.plot()
+        if self.dispersion:
+            self._init_dispersion()
+
+    def _density(self):
+        return self.scheme.spectral_density(N = self.density, bins = self.density_bins)
+
+    def _density_image(self, counts):
+        # logarithmic scale normalized in [0, 1]
+        img = np.log1p(counts)
+        return img/max(img.max(), 1)
+
+    def _sigma(self, scheme):
+        """
+        return the grid sigma of the pseudospectra of scheme (None without pseudospectra)
+        """
+        if not self.pseudospectra:
+            return None
+        return scheme.pseudospectrum(x_range = (-1.1, 1.1),
+                                     y_range = (-1.1, 1.1),
+                                     n = self.pseudospectra_n)[2]
+
+    def _pseudospectra_points(self, sigma):
+        """
+        return the list of the points (x, y) of each pseudospectrum
+        """
+        if sigma is None:
+            return []
+        x, y = np.meshgrid(np.linspace(-1.1, 1.1, self.pseudospectra_n),
+                           np.linspace(-1.1, 1.1, self.pseudospectra_n))
+        return [(x[sigma < eps], y[sigma < eps]) for eps in self.pseudospectra]
+
+    def _init_dispersion(self):
+        ind = self.scheme.vxi <= np.pi
+        self.xi = self.scheme.vxi[ind]
+        res = self.scheme.dispersion()
+        self.fig_disp = self.viewer.Fig(x_range = (0, np.pi),
+                                        y_range = (-1.6, 1.6),
+                                        x_label = 'wavenumber',
+                                        width=400,
+                                        height=400,)
+        self.fig_disp.title('dispersion',
+                            title_size = 20,
+                            title_color = 'black',
+                            title_align = 'center')
+        self.amplification, self.velocity = [], []
+        for k in range(res['amplification'].shape[1]):
+            self.amplification.append(self.fig_disp.line(self.xi, res['amplification'][ind, k],
+                                                         line_width = 2,
+                                                         line_color = 'navy',
+                                                         line_alpha = 1,
+                                                         label = 'amplification' if k == 0 else None))
+            self.velocity.append(self.fig_disp.line(self.xi, res['phase_velocity'][ind, k],
+                                                    line_width = 2,
+                                                    line_color = 'orange',
+                                                    line_alpha = 1,
+                                                    label = 'phase velocity' if k == 0 else None))
+        self.fig_disp.plot()
+
+    def _update_dispersion(self):
+        ind = self.scheme.vxi <= np.pi
+        res = self.scheme.dispersion()
+        for k in range(len(self.amplification)):
+            self.amplification[k].update(self.xi, res['amplification'][ind, k])
+            self.velocity[k].update(self.xi, res['phase_velocity'][ind, k])
+        self.fig_disp.update()
 
     def update(self, **args):
+        self.cancel_prefetch()
+        key = self.key(args)
         self.scheme.fix_parameters(args)
-        self.scheme.compute_eqeq()
+        cached = self.cache.get(key)
+        # a single get: a prefetch task can evict the key at any time
+        prefetched = None if cached is not None else self.prefetched.get(key)
+        if prefetched is not None:
+            vvp, eqeq, sigma = prefetched
+            if sigma is None:
+                sigma = self._sigma(self.scheme)
+            cached = (vvp, eqeq, sigma)
+            self.cache.put(key, *cached)
+        if self.density is not None:
+            # the cache stores the histograms instead of the spectra
+            if cached is None:
+                self.scheme.compute_eqeq()
+                counts, sigma = self._density(), self._sigma(self.scheme)
+                self.cache.put(key, counts, self.scheme.eqeq, sigma)
+            else:
+                counts, self.scheme.eqeq, sigma = cached
+        elif cached is None:
+            self.scheme.compute_eqeq()
+            self.scheme.eigenvalues(warm = True)
+            sigma = self._sigma(self.scheme)
+            self.cache.put(key, self.scheme.vvp, self.scheme.eqeq, sigma)
+        else:
+            self.scheme.vvp[:], self.scheme.eqeq, sigma = cached
         print(self.scheme.eqeq)
-        self.scheme.eigenvalues()
-        self.points.update(np.real(self.scheme.vvp), np.imag(self.scheme.vvp))
+        for level, (x, y) in zip(self.levels, self._pseudospectra_points(sigma)):
+            level.update(x, y)
+        if self.density is None:
+            self.points.update(np.real(self.scheme.vvp), np.imag(self.scheme.vvp))
+        else:
+            self.image.update(self._density_image(counts))
         self.fig.update()
+        if self.dispersion:
+            self._update_dispersion()
+        self.prefetch(args)
 
-def interactive_plot(scheme, viewer = 'bokeh'):
-    graph = graphique(scheme, viewer = viewer)
-    graph.g.build(graph.update)
+def interactive_plot(scheme, viewer = 'bokeh', cache_size = 2**26,
+                     delay = 0.05, background = False, prefetch = True,
+                     dispersion = False, pseudospectra = None, density = None):
+    graph = graphique(scheme, viewer = viewer, cache_size = cache_size,
+                      prefetch = prefetch, dispersion = dispersion,
+                      pseudospectra = pseudospectra, density = density)
+    graph.g.build(graph.update, delay = delay, background = background)
     graph.g.plot()
+    return graph
+
+class stability_map():
+    """
+    progressive heatmap of the spectral radius in a plane of the parameter space
+
+    the map is computed on a coarse grid first, then refined in passes:
+    each pass halves the stride of the grid, the new points of a cell whose
+    four corners are all stable (or all clearly unstable) inherit the value
+    of the corners and are not computed. The passes are computed by batches
+    and the image is updated after each batch.
+
+    Parameters
+    ----------
+
+    scheme : the scheme (see schemes.Oned)
+    x : string, the parameter of the horizontal axis
+    y : string, the parameter of the vertical axis
+    x_range : a tuple for min and max value of x, optional (default is the slider range)
+    y_range : a tuple for min and max value of y, optional (default is the slider range)
+    n : integer, optional
+        number of points of the coarse grid in each direction
+    levels : integer, optional
+        number of refinement passes (the final grid has (n-1) 2^levels + 1 points)
+    graph : graphique, optional
+        clicking a cell of the map sets the parameters of this eigenvalue plot
+    viewer : string, optional (default is 'bokeh')
+    background : boolean, optional
+        if True, the refinement passes are computed in a worker thread
+        (only with the viewer bokeh which pushes the updates from the
+        event loop of the kernel; default is True for bokeh, False otherwise)
+    batch : integer, optional
+        number of points computed between two updates of the image
+    tol : float, optional
+        a point is stable if its spectral radius is below 1 + tol
+    margin : float, optional
+        a point is clearly unstable if its spectral radius is above 1 + margin
+    v_range : a tuple for min and max value of the colormap, optional
+
+    """
+    def __init__(self, scheme, x, y, x_range = None, y_range = None,
+                 n = 9, levels = 4, graph = None, viewer = 'bokeh',
+                 background = None, batch = 64, tol = 1.e-8, margin = 1.e-2,
+                 v_range = (.5, 1.5)):
+        self.viewer = viewers.list_viewers.get(viewer, viewers.list_viewers['matplotlib'])
+        self.scheme = copy.deepcopy(scheme)
+        self.x, self.y = x, y
+        model = {d['variable']: d for d in scheme.p_model}
+        self.x_range = x_range if x_range is not None else (model[x]['min'], model[x]['max'])
+        self.y_range = y_range if y_range is not None else (model[y]['min'], model[y]['max'])
+        self.levels = levels
+        self.size = (n - 1)*2**levels + 1
+        self.vx = np.linspace(*self.x_range, self.size)
+        self.vy = np.linspace(*self.y_range, self.size)
+        # rho[j, i] for y = vy[j] and x = vx[i], nan if unknown
+        self.rho = np.full((self.size, self.size), np.nan)
+        self.computed = np.zeros(self.rho.shape, dtype = 'bool')
+        self.graph = graph
+        self.batch = batch
+        self.tol = tol
+        self.margin = margin
+        self.nsolve = 0
+        self.running = True
+        stride = 2**levels
+        self._compute(list(np.ndindex(n, n)), stride)
+        self._init_graph(v_range)
+        self.thread = None
+        # the figures of matplotlib cannot be drawn from another thread
+        threaded = self.viewer is viewers.list_viewers['bokeh']
+        if background is None:
+            background = threaded
+        elif background and not threaded:
+            print("The refinement is computed in the main thread with this viewer")
+            background = False
+        if background:
+            self.thread = threading.Thread(target = self.run, daemon = True)
+            self.thread.start()
+        else:
+            self.run()
+
+    def _init_graph(self, v_range):
+        self.fig = self.viewer.Fig(x_range = self.x_range,
+                                   y_range = self.y_range,
+                                   x_label = self.x,
+                                   y_label = self.y,
+                                   width = 400,
+                                   height = 400,)
+        self.fig.title("{0}: spectral radius".format(self.scheme._name),
+                       title_size = 14,
+                       title_color = 'black',
+                       title_align = 'center')
+        self.image = self.fig.image(self._display(2**self.levels), self.x_range, self.y_range,
+                                    v_range = v_range)
+        self.fig.on_click(self.select)
+        self.fig.plot()
+
+    def _compute(self, points, stride):
+        # spectral radius of the points (j, i) of the grid of the given stride
+        param = dict(self.scheme.param)
+        for j, i in points:
+            param[self.x] = self.vx[i*stride]
+            param[self.y] = self.vy[j*stride]
+            self.scheme.fix_parameters(param)
+            self.rho[j*stride, i*stride] = self.scheme.spectral_radius()
+            self.computed[j*stride, i*stride] = True
+            self.nsolve += 1
+
+    def _display(self, stride, current = None):
+        # each known point of the grid of the given stride paints its block,
+        # the points of the current pass (stride/2) paint smaller blocks
+        img = np.repeat(np.repeat(self.rho[::stride, ::stride], stride, axis = 0),
+                        stride, axis = 1)[:self.size, :self.size]
+        if current is not None:
+            h = stride//2
+            for j, i in current:
+                img[j*h:(j+1)*h, i*h:(i+1)*h] = self.rho[j*h, i*h]
+        return img
+
+    def passes(self):
+        """
+        generator of the refinement passes: compute the points by batches
+        and yield the image after each batch
+        """
+        stride = 2**self.levels
+        while stride > 1 and self.running:
+            h = stride//2
+            coarse = self.rho[::stride, ::stride]
+            stable = coarse <= 1 + self.tol
+            unstable = coarse > 1 + self.margin
+            n = (self.size - 1)//h + 1
+            todo, done = [], []
+            for j in range(n):
+                for i in range(n):
+                    if j % 2 == 0 and i % 2 == 0:
+                        continue
+                    # corners of the cell of the coarse grid containing the point
+                    j0, j1 = j//2, (j + 1)//2
+                    i0, i1 = i//2, (i + 1)//2
+                    corners = [(j0, i0), (j0, i1), (j1, i0), (j1, i1)]
+                    if all(stable[c] for c in corners) or all(unstable[c] for c in corners):
+                        self.rho[j*h, i*h] = np.mean([coarse[c] for c in corners])
+                        done.append((j, i))
+                    else:
+                        todo.append((j, i))
+            for k in range(0, len(todo), self.batch):
+                if not self.running:
+                    return
+                self._compute(todo[k:k+self.batch], h)
+                done += todo[k:k+self.batch]
+                yield self._display(stride, done)
+            stride = h
+        yield self._display(stride)
+
+    def run(self):
+        """
+        compute the refinement passes and update the image
+        """
+        for img in self.passes():
+            self.image.update(img)
+            self.fig.update()
+
+    def stop(self):
+        """
+        stop the refinement
+        """
+        self.running = False
+
+    def select(self, x, y):
+        """
+        set the parameters of the eigenvalue plot to the cell (x, y) of the map
+        """
+        if self.graph is None:
+            return
+        i = int(np.argmin(np.abs(self.vx - x)))
+        j = int(np.argmin(np.abs(self.vy - y)))
+        values = {self.x: self.vx[i], self.y: self.vy[j]}
+        sliders = self.graph.g.variables
+        if hasattr(self.graph.g, 'dispatch'):
+            # the sliders call the update of the graph
+            for name, val in values.items():
+                sliders[name].value = val
+        else:
+            param = {name: w.value for name, w in sliders.items()}
+            param.update(values)
+            self.graph.update(**param)
+
+def _spectrum_setup(scheme):
+    fig = viewers.agg_viewer.Fig(x_range = (-1.1, 1.1),
+                                 y_range = (-1.1, 1.1),
+                                 x_label = 'real part',
+                                 y_label = 'imaginary part',
+                                 width = 400,
+                                 height = 400,)
+    t = np.linspace(0, 2*np.pi, 1000)
+    fig.line(np.cos(t), np.sin(t),
+             line_width = 2,
+             line_color = 'navy',
+             line_alpha = 1)
+    points = fig.scatter(np.zeros(scheme.vvp.size), np.zeros(scheme.vvp.size),
+                         color = 'orange',
+                         marker = 'circle',
+                         size = 5,
+                         alpha = 0.5)
+    return fig, (fig, scheme, points)
+
+def _spectrum_update(artists, param):
+    fig, scheme, points = artists
+    scheme.fix_parameters(param)
+    scheme.eigenvalues()
+    points.update(np.real(scheme.vvp), np.imag(scheme.vvp))
+    fig.title(scheme._name + ': ' + ', '.join('{0}={1:.3g}'.format(k, v) for k, v in sorted(param.items())),
+              title_size = 10,
+              title_color = 'black',
+              title_align = 'center')
+
+def export_spectra(scheme, params, filename = 'spectrum_{0:05d}.png', processes = None,
+                   video = None, fps = 25):
+    """
+    render the spectrum of the scheme for a list of parameters in PNG files
+    (or a video) without notebook, with a pool of processes
+
+    Parameters
+    ----------
+
+    scheme : the scheme (see schemes.Oned)
+    params : list of dictionaries of the parameters
+    filename : string, optional
+        pattern of the names of the files (formatted with the index of the parameters)
+    processes : integer, optional
+        number of worker processes (default is the number of cores)
+    video : string, optional
+        name of a video file (needs ffmpeg)
+    fps : integer, optional
+        number of frames per second of the video
+
+    Returns
+    -------
+
+    the list of the names of the PNG files
+
+    """
+    return viewers.agg_viewer.render(functools.partial(_spectrum_setup, scheme),
+                                     _spectrum_update,
+                                     [dict(scheme.param, **p) for p in params],
+                                     filename = filename,
+                                     processes = processes,
+                                     video = video,
+                                     fps = fps)
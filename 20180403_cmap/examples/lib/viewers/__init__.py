@@ -1,7 +1,8 @@
-from . import bokeh_viewer, matplotlib_viewer#, bqplot_viewer
+from . import bokeh_viewer, matplotlib_viewer, agg_viewer#, bqplot_viewer
 
 list_viewers = {
     'matplotlib': matplotlib_viewer,
     'bokeh': bokeh_viewer,
+    'agg': agg_viewer,
     #'bqplot': bqplot_viewer,
 }
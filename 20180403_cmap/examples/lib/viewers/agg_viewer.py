@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from . import matplotlib_viewer
+from .matplotlib_viewer import line, scatter, fill, image
+
+LaTeX = True
+
+class Fig(matplotlib_viewer.Fig):
+    """
+    Class Fig using the Agg backend of matplotlib without pyplot
+    (no display, no global state: the figures can be built in worker processes)
+
+    same parameters as matplotlib_viewer.Fig
+    """
+    def _subplots(self, figsize):
+        fig = Figure(figsize = figsize)
+        FigureCanvasAgg(fig)
+        return fig, fig.add_subplot(1, 1, 1)
+
+
+# state of a worker process of render
+_render_state = {}
+
+def _render_init(setup, update, filename, dpi):
+    fig, artists = setup()
+    _render_state['args'] = (fig, artists, update, filename, dpi)
+
+def _render_task(frames):
+    fig, artists, update, filename, dpi = _render_state['args']
+    for k, frame in frames:
+        update(artists, frame)
+        fig.savefig(filename.format(k), dpi = dpi)
+
+def render(setup, update, frames, filename = 'frame_{0:05d}.png', processes = None,
+           video = None, fps = 25, dpi = None):
+    """
+    render a sequence of frames in PNG files with a pool of processes
+
+    each process builds its figure once with setup and draws the frames
+    of its chunks by calling update: setup and update must be picklable
+    (functions defined at the level of a module)
+
+    Parameters
+    ----------
+
+    setup : function without argument that returns (fig, artists)
+        where fig is an agg_viewer.Fig
+    update : function update(artists, frame) that modifies the artists
+    frames : list of the data of the frames (given to update)
+    filename : string, optional
+        pattern of the names of the files (formatted with the index of the frame)
+    processes : integer, optional
+        number of worker processes (default is the number of cores)
+    video : string, optional
+        name of a video file encoded from the PNG files by ffmpeg
+    fps : integer, optional
+        number of frames per second of the video
+    dpi : integer, optional
+        resolution of the PNG files
+
+    Returns
+    -------
+
+    the list of the names of the PNG files
+
+    """
+    frames = list(frames)
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(frames)))
+    indexed = list(enumerate(frames))
+    if processes == 1:
+        _render_init(setup, update, filename, dpi)
+        _render_task(indexed)
+    else:
+        # several chunks per process to balance the load
+        nchunks = min(len(frames), 4*processes)
+        bounds = np.linspace(0, len(frames), nchunks + 1).astype('int')
+        with multiprocessing.Pool(processes,
+                                  initializer = _render_init,
+                                  initargs = (setup, update, filename, dpi)) as pool:
+            pool.map(_render_task, [indexed[a:b] for a, b in zip(bounds[:-1], bounds[1:])])
+    if video is not None:
+        encode(filename, video, fps)
+    return [filename.format(k) for k in range(len(frames))]
+
+def encode(filename, video, fps = 25):
+    """
+    encode the PNG files given by the pattern filename in a video file with ffmpeg
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is needed to write a video file")
+    # python format of the index -> printf format of ffmpeg
+    pattern = re.sub(r'\{0(?::(0\d+)d)?\}', lambda m: '%' + (m.group(1) or '') + 'd', filename)
+    subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-framerate', str(fps),
+                    '-i', pattern, '-pix_fmt', 'yuv420p', video], check = True)
@@ -1,12 +1,26 @@
+import asyncio
+import threading
+import time
 import numpy as np
 import bokeh
-from bokeh.models import FuncTickFormatter
+from bokeh.models import FuncTickFormatter, LinearColorMapper
 from bokeh.io import push_notebook, show, output_notebook
 from bokeh.plotting import figure
 from bokeh.resources import INLINE, CDN
 
+from .decimation import downsample, decimate
+
 LaTeX = False
 
+traduction_palette = {
+    'viridis': 'Viridis256',
+    'magma': 'Magma256',
+    'inferno': 'Inferno256',
+    'plasma': 'Plasma256',
+    'gray': 'Greys256',
+    'RdBu': 'RdBu11',
+}
+
 modify_exposant = """
 var str = Math.log10(tick).toString(); //get exponent
 var newStr = "";
@@ -33,6 +47,38 @@ for (var i=0; i<str.length;i++)
 return 10+newStr;
 """
 
+def set_columns(source, **columns):
+    """
+    update the columns of a ColumnDataSource
+
+    the columns are converted in float32 (sent as binary buffers) and only the
+    modified columns are sent when the length does not change
+    """
+    columns = {k: np.asarray(v, dtype = 'float32') for k, v in columns.items()}
+    data = source.data
+    if any(k not in data or len(data[k]) != v.size for k, v in columns.items()):
+        source.data = columns
+        return
+    for k, v in columns.items():
+        if not np.array_equal(data[k], v):
+            data[k] = v
+
+class comms_counter():
+    """
+    proxy of the comms of a notebook handle that measures the sent messages
+    """
+    def __init__(self, comms):
+        self.comms = comms
+        self.nbytes = 0
+    def send(self, data = None, buffers = None, **kwargs):
+        if data is not None:
+            self.nbytes += len(data)
+        if buffers is not None:
+            self.nbytes += sum(len(b) for b in buffers)
+        return self.comms.send(data, buffers = buffers, **kwargs)
+    def __getattr__(self, name):
+        return getattr(self.comms, name)
+
 class Fig():
     """
     Class Fig using bokeh module
@@ -44,14 +90,30 @@ class Fig():
     y_range : a tuple for min and max value of the y coordinate
     width : integer, optional (default value is 450)
     height : integer, optional (default value is 300)
+    max_fps : float, optional (default value is 30)
+        maximal number of pushes to the notebook per second,
+        the updates in between are coalesced in the next push
 
     """
     def __init__(self, x_range = (0,0), y_range = None,
                  width=450,
                  height=300,
                  x_label=None, y_label=None,
-                 x_axis_type='auto', y_axis_type='auto'
+                 x_axis_type='auto', y_axis_type='auto',
+                 max_fps = 30
                  ):
+        self.handle = None
+        self.width = width
+        self.height = height
+        self.max_fps = max_fps
+        self.last_push = 0.
+        self.pending = False
+        self.lock = threading.Lock()
+        self.loop = None
+        self.pushes = 0
+        self.coalesced = 0
+        self.nbytes = 0
+        self.push_time = 0.
 
         output_notebook(resources = INLINE, hide_banner=True)
         self.fig = figure(x_range=x_range,
@@ -103,7 +165,8 @@ class Fig():
             except:
                 print("Update bokeh to have interactive legend")
 
-    def line(self, x, y, line_width = 2, line_color = 'black', line_alpha = 1, line_marker = None, label = None):
+    def line(self, x, y, line_width = 2, line_color = 'black', line_alpha = 1, line_marker = None, label = None,
+             decimation = 'minmax'):
         """
         plot a line
 
@@ -117,9 +180,12 @@ class Fig():
         line_marker : marker
         line_color : string, optional
         label : string, optional
+        decimation : string, optional
+            'minmax' or 'lttb': the points sent are reduced to the width
+            of the figure in pixels, None to send all the points
 
         """
-        return line(self.fig, x, y, line_width, line_color, line_alpha, line_marker, label)
+        return line(self.fig, x, y, line_width, line_color, line_alpha, line_marker, label, decimation)
 
     def scatter(self, x, y, marker = 'circle_x', size = 10, color = 'black', alpha = 0.5, label = None):
         """
@@ -156,12 +222,92 @@ class Fig():
         """
         return fill(self.fig, x, y1, y2, fill_color, fill_alpha, line_width, line_color)
 
+    def image(self, data, x_range, y_range, v_range = None, palette = 'viridis', downsample = True):
+        """
+        plot an image
+
+        Parameters
+        ----------
+
+        data : numpy array of shape (ny, nx), the first line is at the bottom
+        x_range : a tuple for min and max value of the x coordinate
+        y_range : a tuple for min and max value of the y coordinate
+        v_range : a tuple for min and max value of the colormap, optional
+        palette : string, optional
+        downsample : boolean, optional
+            if True, the data is averaged by blocks to the size in pixels
+            of the figure before being drawn
+
+        the data is converted in float32 and update(data) modifies
+        the image in place
+
+        """
+        return image(self.fig, data, x_range, y_range, v_range,
+                     traduction_palette.get(palette, palette),
+                     (self.height, self.width) if downsample else None)
+
+    field = image
+
+    def on_click(self, callback):
+        print("The viewer Bokeh cannot send the clicks to python")
+
     def plot(self):
         self.handle = show(self.fig, notebook_handle=True)
+        if self.handle is not None:
+            self.handle._comms = comms_counter(self.handle._comms)
+        # event loop of the kernel: the delayed pushes are scheduled on it,
+        # also for the updates coming from other threads
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
 
     def update(self):
-        notebook_handle=True
+        """
+        push the modifications to the notebook
+
+        at most max_fps pushes per second: an update received too early
+        is delayed and coalesced with the next ones. The updates from other
+        threads are pushed by the event loop of the kernel (if it is running).
+        """
+        with self.lock:
+            if self.handle is None or self.pending:
+                self.coalesced += self.pending
+                return
+            wait = self.last_push + 1./self.max_fps - time.monotonic()
+            loop = self.loop if self.loop is not None and self.loop.is_running() else None
+            if loop is not None and (wait > 0 or not self._in_loop(loop)):
+                self.pending = True
+                loop.call_soon_threadsafe(loop.call_later, max(wait, 0), self._push)
+                return
+        self._push()
+
+    @staticmethod
+    def _in_loop(loop):
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    def _push(self):
+        t0 = time.perf_counter()
+        nbytes = self.handle._comms.nbytes
+        self.pending = False
         push_notebook(handle = self.handle)
+        self.last_push = time.monotonic()
+        self.push_time = time.perf_counter() - t0
+        self.nbytes = self.handle._comms.nbytes - nbytes
+        self.pushes += 1
+
+    def stats(self):
+        """
+        return the number of pushes, of coalesced updates,
+        and the payload in bytes and the time of the last push
+        """
+        return {'pushes': self.pushes,
+                'coalesced': self.coalesced,
+                'nbytes': self.nbytes,
+                'push_time': self.push_time}
 
     def savefig(self, filename):
         print("The viewer Bokeh cannot save the figure")
@@ -171,9 +317,13 @@ class line():
     """
     line object
     """
-    def __init__(self, fig, x, y, lw, c, alpha, m, label):
+    def __init__(self, fig, x, y, lw, c, alpha, m, label, decimation = None):
         if isinstance(c, tuple):
             c = tuple([int(a*255) for a in c])
+        self.fig = fig
+        self.decimation = decimation
+        self.x, self.y = np.asarray(x), np.asarray(y)
+        x, y = self.reduce()
         self.l = fig.line(x, y, line_width = lw, color = c, line_alpha = alpha, legend = label)
         self.l.visible = True
         if m is not None:
@@ -188,14 +338,61 @@ class line():
             self.m.visible = True
         else:
             self.marker = False
+        if decimation is not None:
+            # only called with a bokeh server
+            fig.x_range.on_change('end', lambda attr, old, new: self.update(self.x, self.y))
+    def reduce(self):
+        """
+        return the points to send
+        """
+        if self.decimation is None:
+            return self.x, self.y
+        x_range = (getattr(self.fig.x_range, 'start', None), getattr(self.fig.x_range, 'end', None))
+        if None in x_range or x_range[1] <= x_range[0]:
+            x_range = None
+        return decimate(self.x, self.y, self.fig.width, x_range, self.decimation)
+    def decimated(self):
+        return self.decimation is not None and self.reduce()[0].size < self.x.size
     def visible(self, b = True):
         self.l.visible = b
         if self.marker:
             self.m.visible = b
     def update(self, x, y):
-        self.l.data_source.data = dict(x = x, y = y)
+        self.x, self.y = np.asarray(x), np.asarray(y)
+        x, y = self.reduce()
+        set_columns(self.l.data_source, x = x, y = y)
         if self.marker:
-            self.m.data_source.data = dict(x = x, y = y)
+            set_columns(self.m.data_source, x = x, y = y)
+    def stream(self, x, y, rollover = None):
+        """
+        append the points (x, y), only the new points are sent
+        (rollover is the maximal number of points kept);
+        the whole decimated line is sent when the line is decimated
+        """
+        self.x = np.append(self.x, x)[-rollover if rollover else None:]
+        self.y = np.append(self.y, y)[-rollover if rollover else None:]
+        if self.decimated():
+            self.update(self.x, self.y)
+            return
+        new = dict(x = np.asarray(x, dtype = 'float32'), y = np.asarray(y, dtype = 'float32'))
+        self.l.data_source.stream(new, rollover)
+        if self.marker:
+            self.m.data_source.stream(new, rollover)
+    def patch(self, start, y):
+        """
+        replace the values y[start:start+len(y)] (sent as a JSON list:
+        use update to modify a large part of the line);
+        the whole decimated line is sent when the line is decimated
+        """
+        self.y = self.y.copy()
+        self.y[start:start + len(y)] = y
+        if self.decimated():
+            self.update(self.x, self.y)
+            return
+        patch = {'y': [(slice(start, start + len(y)), np.asarray(y, dtype = 'float32'))]}
+        self.l.data_source.patch(patch)
+        if self.marker:
+            self.m.data_source.patch(patch)
     def line_color(self, c):
         if isinstance(c, tuple):
             c = tuple([int(a*255) for a in c])
@@ -223,7 +420,14 @@ class scatter():
     def visible(self, b = True):
         self.l.visible = b
     def update(self, x, y):
-        self.l.data_source.data = dict(x = x, y = y)
+        set_columns(self.l.data_source, x = x, y = y)
+    def stream(self, x, y, rollover = None):
+        """
+        append the points (x, y), only the new points are sent
+        (rollover is the maximal number of points kept)
+        """
+        self.l.data_source.stream(dict(x = np.asarray(x, dtype = 'float32'),
+                                       y = np.asarray(y, dtype = 'float32')), rollover)
     def line_color(self, c):
         if isinstance(c, tuple):
             c = tuple([int(a*255) for a in c])
@@ -265,4 +469,29 @@ class fill():
         else:
             xx = np.append(x, x[::-1])
             yy = np.append(y1, y2[::-1])
-        self.l.data_source.data = dict(x = xx, y = yy)
+        set_columns(self.l.data_source, x = xx, y = yy)
+
+class image():
+    """
+    image object
+    """
+    def __init__(self, fig, data, x_range, y_range, v_range, palette, shape):
+        self.shape = shape
+        data = self.prepare(data)
+        if v_range is None:
+            v_range = (np.nanmin(data), np.nanmax(data))
+        mapper = LinearColorMapper(palette = palette, low = v_range[0], high = v_range[1])
+        self.l = fig.image(image = [data],
+                           x = x_range[0],
+                           y = y_range[0],
+                           dw = x_range[1] - x_range[0],
+                           dh = y_range[1] - y_range[0],
+                           color_mapper = mapper)
+        self.l.visible = True
+    def visible(self, b = True):
+        self.l.visible = b
+    def prepare(self, data):
+        data = np.asarray(data, dtype = 'float32')
+        return data if self.shape is None else downsample(data, self.shape)
+    def update(self, data):
+        self.l.data_source.data['image'] = [self.prepare(data)]
@@ -0,0 +1,91 @@
+import numpy as np
+
+def downsample(data, shape):
+    """
+    reduce a 2D array to at most shape = (ny, nx) values by averaging
+    blocks of integer size (the last lines and columns that do not fill
+    a whole block are dropped)
+
+    the data is returned unchanged if it is smaller than shape
+    """
+    fy = -(-data.shape[0] // shape[0])
+    fx = -(-data.shape[1] // shape[1])
+    if fx == 1 and fy == 1:
+        return data
+    ny, nx = data.shape[0]//fy, data.shape[1]//fx
+    return data[:ny*fy, :nx*fx].reshape((ny, fy, nx, fx)).mean(axis = (1, 3), dtype = data.dtype)
+
+def _visible(x, x_range):
+    # indices of the points in x_range and of one neighbour on each side
+    # (x is sorted)
+    if x_range is None:
+        return 0, x.size
+    start = max(0, np.searchsorted(x, x_range[0], side = 'left') - 1)
+    stop = min(x.size, np.searchsorted(x, x_range[1], side = 'right') + 1)
+    return start, stop
+
+def minmax(x, y, n, x_range = None):
+    """
+    keep for each of the n columns of pixels of x_range the points where
+    y is minimal and maximal (and the first and the last points)
+
+    x must be sorted, the result has at most 2 n + 2 points in the order of x
+    """
+    start, stop = _visible(x, x_range)
+    x, y = x[start:stop], y[start:stop]
+    if x.size <= 2*n + 2:
+        return x, y
+    x0, x1 = (x[0], x[-1]) if x_range is None else x_range
+    col = np.clip(((x - x0)*(n/(x1 - x0))).astype('int64'), -1, n)
+    # x is sorted: the columns are contiguous segments
+    first = np.flatnonzero(np.diff(col)) + 1
+    bounds = np.concatenate(([0], first))
+    seg = np.repeat(np.arange(bounds.size), np.diff(np.concatenate((bounds, [x.size]))))
+    yy = np.where(np.isnan(y), np.inf, y)
+    imin = np.flatnonzero(yy == np.minimum.reduceat(yy, bounds)[seg])
+    yy = np.where(np.isnan(y), -np.inf, y)
+    imax = np.flatnonzero(yy == np.maximum.reduceat(yy, bounds)[seg])
+    # first occurrence in each segment
+    imin = imin[np.unique(seg[imin], return_index = True)[1]]
+    imax = imax[np.unique(seg[imax], return_index = True)[1]]
+    ind = np.union1d(np.union1d(imin, imax), [0, x.size - 1])
+    return x[ind], y[ind]
+
+def lttb(x, y, n, x_range = None):
+    """
+    largest triangle three buckets: keep n points (one by bucket of the
+    points in x_range) that preserve the shape of the curve
+
+    x must be sorted
+    """
+    start, stop = _visible(x, x_range)
+    x, y = x[start:stop], y[start:stop]
+    if x.size <= n or n < 3:
+        return x, y
+    bounds = np.linspace(1, x.size - 1, n - 1).astype('int64')
+    ind = np.empty((n,), dtype = 'int64')
+    ind[0], ind[-1] = 0, x.size - 1
+    a = 0
+    for k in range(n - 2):
+        lo, hi = bounds[k], bounds[k+1]
+        # average of the next bucket
+        nlo, nhi = hi, bounds[k+2] if k + 2 < n - 1 else x.size
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx)*(y[lo:hi] - y[a]) - (x[a] - x[lo:hi])*(cy - y[a]))
+        a = lo + int(np.argmax(area))
+        ind[k+1] = a
+    return x[ind], y[ind]
+
+methods = {'minmax': minmax, 'lttb': lttb}
+
+def decimate(x, y, n, x_range = None, method = 'minmax'):
+    """
+    reduce the points of a line to the resolution of n pixels
+    with the given method ('minmax' or 'lttb'), the data is unchanged
+    if x is not sorted
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if x.ndim != 1 or x.size <= 2*n + 2 or np.any(np.diff(x) < 0):
+        return x, y
+    return methods[method](x, y, n, x_range)
@@ -1,7 +1,11 @@
 import matplotlib.pyplot as plt
 import numpy as np
 
+from .decimation import downsample, decimate
+
 LaTeX = True
+# default value of the blitting mode of the figures
+blit = False
 
 traduction_marker = {
     'circle_cross': 'o',
@@ -30,15 +34,26 @@ class Fig():
     y_range : a tuple for min and max value of the y coordinate
     width : integer, optional (default value is 450)
     height : integer, optional (default value is 300)
+    blit : boolean, optional (default value is the module variable blit)
+        if True, the static part of the figure is cached and update redraws
+        only the artists modified since the last frame
 
     """
     def __init__(self, x_range = (0,0), y_range = None,
                  width=450,
                  height=300,
                  x_label=None, y_label=None,
-                 x_axis_type=None, y_axis_type=None):
-
-        self.fig, self.ax = plt.subplots(figsize = (int(width/75), int(height/75)))
+                 x_axis_type=None, y_axis_type=None,
+                 blit=None):
+
+        self.fig, self.ax = self._subplots((int(width/75), int(height/75)))
+        self.blit = globals()['blit'] if blit is None else blit
+        self.artists = []
+        self.animated = []
+        self.background = None
+        self.saving = False
+        if self.blit:
+            self.fig.canvas.mpl_connect('draw_event', self._on_draw)
         self.ax.set_xlim(*x_range)
         if y_range is not None:
             self.ax.set_ylim(*y_range)
@@ -52,6 +67,9 @@ class Fig():
         if y_axis_type is not None:
             self.ax.set_yscale(y_axis_type)
 
+    def _subplots(self, figsize):
+        return plt.subplots(figsize = figsize)
+
     def title(self, title_str, title_color = 'black', title_align = 'center',
               title_size = 20):
         """
@@ -75,7 +93,8 @@ class Fig():
         if click_policy is not None:
             pass
 
-    def line(self, x, y, line_width = 2, line_color = 'black', line_alpha = 1, line_marker = None, label = None):
+    def line(self, x, y, line_width = 2, line_color = 'black', line_alpha = 1, line_marker = None, label = None,
+             decimation = 'minmax'):
         """
         plot a line
 
@@ -86,10 +105,14 @@ class Fig():
         y : numpy array of the y coordinate
         line_width : integer, optional
         color : string, optional
+        decimation : string, optional
+            'minmax' or 'lttb': the points drawn are reduced to the resolution
+            of the axes (computed again when the x limits change),
+            None to draw all the points
 
         """
         marker = traduction_marker.get(line_marker, line_marker)
-        return line(self.ax, x, y, line_width, line_color, line_alpha, marker, label)
+        return self._add(line(self.ax, x, y, line_width, line_color, line_alpha, marker, label, decimation))
 
     def scatter(self, x, y, marker = 'circle_x', size = 10, color = 'black', alpha = 0.5, label = None):
         """
@@ -109,7 +132,7 @@ class Fig():
 
         """
         m = traduction_marker.get(marker, marker)
-        return scatter(self.ax, x, y, m, size, color, alpha, label)
+        return self._add(scatter(self.ax, x, y, m, size, color, alpha, label))
 
     def fill(self, x, y1, y2 = None, line_width = 1, line_color = 'black', fill_color = 'black', fill_alpha = 0.25):
         """
@@ -127,29 +150,131 @@ class Fig():
         line_color : string, optional
 
         """
-        return fill(self.ax, x, y1, y2, fill_color, fill_alpha, line_width, line_color)
+        return self._add(fill(self.ax, x, y1, y2, fill_color, fill_alpha, line_width, line_color))
+
+    def image(self, data, x_range, y_range, v_range = None, palette = 'viridis', downsample = True):
+        """
+        plot an image
+
+        Parameters
+        ----------
+
+        data : numpy array of shape (ny, nx), the first line is at the bottom
+        x_range : a tuple for min and max value of the x coordinate
+        y_range : a tuple for min and max value of the y coordinate
+        v_range : a tuple for min and max value of the colormap, optional
+        palette : string, optional
+        downsample : boolean, optional
+            if True, the data is averaged by blocks to the size in pixels
+            of the figure before being drawn
+
+        the data is converted in float32 and update(data) modifies
+        the image in place
+
+        """
+        shape = None
+        if downsample:
+            bbox = self.ax.get_window_extent()
+            shape = (max(1, int(bbox.height)), max(1, int(bbox.width)))
+        return self._add(image(self.ax, data, x_range, y_range, v_range, palette, shape))
+
+    field = image
+
+    def on_click(self, callback):
+        """
+        call callback(x, y) when the figure is clicked
+        """
+        def onclick(event):
+            if event.inaxes is self.ax:
+                callback(event.xdata, event.ydata)
+        self.fig.canvas.mpl_connect('button_press_event', onclick)
+
+    def _add(self, obj):
+        self.artists.extend(obj.l if isinstance(obj.l, list) else [obj.l])
+        return obj
+
+    def _on_draw(self, event):
+        # the background is captured after each full draw (without the animated artists)
+        # except the draws of savefig where the animated artists are drawn
+        if self.saving:
+            return
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
 
     def plot(self):
         pass
 
     def update(self):
-        pass
+        """
+        redraw the modified artists (blitting mode only)
 
-    def savefig(self, filename):
+        the artists modified for the first time become animated: they are
+        removed from the cached background by a full draw
+        """
+        if not self.blit:
+            return
+        new = [a for a in self.artists if a.stale and not a.get_animated()]
+        for a in new:
+            a.set_animated(True)
+            self.animated.append(a)
+        canvas = self.fig.canvas
+        if new or self.background is None:
+            canvas.draw()
+        canvas.restore_region(self.background)
+        for a in self.animated:
+            self.ax.draw_artist(a)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def _draw_all(self, draw):
+        # draw including the animated artists (they are not drawn otherwise),
+        # the background of the blitting is not captured during this draw
+        self.saving = True
+        for a in self.animated:
+            a.set_animated(False)
+        try:
+            return draw()
+        finally:
+            for a in self.animated:
+                a.set_animated(True)
+            self.saving = False
+
+    def savefig(self, filename, dpi = None):
         if filename is not None:
-            plt.savefig(filename)
+            self._draw_all(lambda: self.fig.savefig(filename, dpi = dpi))
+
+    def render(self):
+        """
+        draw the figure and return the RGBA array of its pixels
+        """
+        self._draw_all(self.fig.canvas.draw)
+        return np.asarray(self.fig.canvas.buffer_rgba()).copy()
 
 
 class line():
     """
     line object
     """
-    def __init__(self, ax, x, y, lw, c, alpha, marker, label):
-        self.l = ax.plot(x, y, color = c, linewidth = lw, alpha = alpha, marker = marker, label = label)
+    def __init__(self, ax, x, y, lw, c, alpha, marker, label, decimation = None):
+        self.ax = ax
+        self.decimation = decimation
+        self.x, self.y = x, y
+        self.l = ax.plot(*self.reduce(), color = c, linewidth = lw, alpha = alpha, marker = marker, label = label)
+        if decimation is not None:
+            ax.callbacks.connect('xlim_changed', lambda ax: self.l[0].set_data(*self.reduce()))
+    def reduce(self):
+        """
+        return the points to draw
+        """
+        xlim = self.ax.get_xlim()
+        if self.decimation is None or self.ax.get_xscale() != 'linear' or xlim[1] <= xlim[0]:
+            return self.x, self.y
+        n = max(1, int(self.ax.get_window_extent().width))
+        return decimate(self.x, self.y, n, xlim, self.decimation)
     def visible(self, b = True):
         plt.setp(self.l, visible = b)
     def update(self, x, y):
-        self.l[0].set_data(x, y)
+        self.x, self.y = x, y
+        self.l[0].set_data(*self.reduce())
     def line_color(self, color):
         plt.setp(self.l, color = color)
 
@@ -178,7 +303,7 @@ class fill():
     """
     fill object
 
-    Warning: cannot manage set_offsets (the collection is removed and then recreated each time)
+    the vertices of the polygon are modified in place by update
     """
     def __init__(self, fig, x, y1, y2, fc, fa, lw, lc):
         self.fc = fc
@@ -190,8 +315,10 @@ class fill():
     def visible(self, b = True):
         plt.setp(self.l, visible = b)
     def update(self, x, y1, y2 = None):
-        self.fig.collections.remove(self.l)
-        self.new_plot(x, y1, y2)
+        if y2 is None:
+            y2 = np.zeros(x.shape)
+        self.l.set_verts([np.column_stack((np.concatenate((x, x[::-1])),
+                                           np.concatenate((y1, y2[::-1]))))])
     def new_plot(self, x, y1, y2 = None):
         if y2 is None:
             y2 = np.zeros(x.shape)
@@ -200,3 +327,26 @@ class fill():
                                        alpha = self.fa,
                                        edgecolors = self.lc,
                                        linewidths = self.lw)
+
+class image():
+    """
+    image object
+    """
+    def __init__(self, ax, data, x_range, y_range, v_range, palette, shape):
+        self.shape = shape
+        vmin, vmax = (None, None) if v_range is None else v_range
+        self.l = ax.imshow(self.prepare(data),
+                           origin = 'lower',
+                           extent = (x_range[0], x_range[1], y_range[0], y_range[1]),
+                           aspect = 'auto',
+                           interpolation = 'nearest',
+                           cmap = palette,
+                           vmin = vmin,
+                           vmax = vmax)
+    def visible(self, b = True):
+        plt.setp(self.l, visible = b)
+    def prepare(self, data):
+        data = np.asarray(data, dtype = 'float32')
+        return data if self.shape is None else downsample(data, self.shape)
+    def update(self, data):
+        self.l.set_data(self.prepare(data))